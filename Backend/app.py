@@ -1,6 +1,10 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from tasksapi.routes import router as api_router
+from tasksapi.crud.conversations import message_writer, message_codec, conversation_archiver
+from tasksapi.crud.usage import usage_writer
+from tasksapi.controllers import job_pool
+from db.db import session_router, create_model_tables
 from config import settings
 
 app = FastAPI(
@@ -10,11 +14,59 @@ app = FastAPI(
     debug=settings.debug,
 )
 
+@app.on_event("startup")
+def create_tables():
+    # Every model is registered by now; no-op on MariaDB, where init_db owns the schema
+    create_model_tables()
+
+@app.on_event("startup")
+def start_background_writers():
+    if settings.persistence_mode == "batched":
+        message_writer.start()
+    usage_writer.start()
+    conversation_archiver.start()
+
+@app.on_event("startup")
+async def start_job_workers():
+    await job_pool.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    # Unfinished jobs stay queued/running in the table and are resumed on next start
+    await job_pool.stop()
+
+@app.on_event("shutdown")
+def flush_background_writers():
+    # Drain queued messages so nothing accepted before shutdown is lost
+    message_writer.stop()
+    usage_writer.stop()
+    conversation_archiver.stop()
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "environment": settings.environment}
 
+@app.get("/health/persistence")
+async def persistence_stats():
+    return {
+        "mode": settings.persistence_mode,
+        "message_writer": message_writer.stats(),
+        "usage_writer": usage_writer.stats(),
+    }
+
+@app.get("/health/storage")
+async def storage_stats():
+    return {"codec": message_codec.stats(), "archiver": conversation_archiver.stats()}
+
+@app.get("/health/jobs")
+async def job_stats():
+    return job_pool.stats()
+
+@app.get("/health/replicas")
+async def replica_stats():
+    return session_router.stats()
+
 # Prefix is used to group routes under a common path
 app.include_router(api_router, prefix="/api")
 
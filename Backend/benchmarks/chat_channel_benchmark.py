@@ -0,0 +1,110 @@
+"""Compare per-turn overhead of the SSE endpoint and the WebSocket channel.
+
+Runs against a live server. The default message trips the out-of-scope
+triage rule, so no LLM call is made and the timings show only transport,
+authentication and persistence overhead.
+
+    python benchmarks/chat_channel_benchmark.py --url http://localhost:8000 \\
+        --username alice --password secret1 --turns 50
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import requests
+import websockets
+
+
+def login(base, username, password) -> str:
+    response = requests.post(f"{base}/api/login", json={"username": username, "password": password}, timeout=30)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def create_conversation(base, token, message) -> int:
+    response = requests.post(
+        f"{base}/api/conversations",
+        json={"first_message": message},
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=120,
+    )
+    response.raise_for_status()
+    return response.json()["conversation_id"]
+
+
+def sse_turns(base, token, conversation_id, message, turns) -> list:
+    """A fresh authenticated POST per turn, as the frontend does today (keep-alive pooled)."""
+    timings = []
+    with requests.Session() as http:
+        for _ in range(turns):
+            started = time.perf_counter()
+            with http.post(
+                f"{base}/api/conversations/{conversation_id}/messages/stream",
+                json={"content": message},
+                headers={"Authorization": f"Bearer {token}"},
+                stream=True,
+                timeout=120,
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line.startswith(b"data: ") and json.loads(line[6:]).get("type") == "done":
+                        break
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+async def ws_turns(base, token, conversation_id, message, turns) -> tuple:
+    """One connection, authenticated once, carrying every turn."""
+    url = base.replace("http", "ws", 1) + f"/api/ws/conversations/{conversation_id}?token={token}"
+    started = time.perf_counter()
+    async with websockets.connect(url) as ws:
+        while json.loads(await ws.recv())["type"] != "ready":
+            pass
+        connect_ms = (time.perf_counter() - started) * 1000
+        timings = []
+        for _ in range(turns):
+            started = time.perf_counter()
+            await ws.send(json.dumps({"type": "message", "content": message}))
+            while True:
+                event = json.loads(await ws.recv())
+                if event["type"] == "error":
+                    raise RuntimeError(event["error"])
+                if event["type"] == "done":
+                    break
+            timings.append((time.perf_counter() - started) * 1000)
+    return connect_ms, timings
+
+
+def summarize(name, timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<10} turns={len(timings):<4} mean={statistics.mean(timings):8.2f}ms "
+          f"p50={statistics.median(timings):8.2f}ms p95={p95:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--message", default="tell me a joke", help="Use a triage phrase to leave the LLM out of the measurement")
+    args = parser.parse_args()
+
+    token = login(args.url, args.username, args.password)
+    conversation_id = create_conversation(args.url, token, args.message)
+
+    sse = sse_turns(args.url, token, conversation_id, args.message, args.turns)
+    connect_ms, ws = asyncio.run(ws_turns(args.url, token, conversation_id, args.message, args.turns))
+
+    summarize("SSE", sse)
+    summarize("WebSocket", ws)
+    print(f"WebSocket connect + auth (once): {connect_ms:.2f}ms")
+    saved = statistics.mean(sse) - statistics.mean(ws)
+    print(f"Per-turn overhead saved by WebSocket: {saved:.2f}ms ({saved / statistics.mean(sse) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
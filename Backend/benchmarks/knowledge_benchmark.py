@@ -0,0 +1,104 @@
+"""Benchmark the local knowledge base as the corpus grows.
+
+Builds indexes over synthetic documents of increasing size and reports build
+time, query latency (single and batched) and memory footprint.
+
+    python benchmarks/knowledge_benchmark.py --sizes 1000 10000 50000
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tasksapi.utils.knowledge import KnowledgeIndex, build_index, get_embedder, EMBEDDINGS_FILE, METADATA_FILE
+
+VOCABULARY = (
+    "blood pressure medication dose tablet morning evening headache fever cough "
+    "allergy antibiotic prescription pharmacy refill appointment clinic nurse doctor "
+    "insulin diabetes glucose cholesterol statin ibuprofen paracetamol side effects "
+    "dizziness nausea rash pregnancy vaccine booster children adults kidney liver "
+    "heart asthma inhaler sleep diet exercise water alcohol interaction missed"
+).split()
+
+
+def write_corpus(directory: Path, chunks: int, words_per_doc: int = 1400, chunk_words: int = 180, overlap: int = 40):
+    rng = random.Random(42)
+    chunks_per_doc = max(1, (words_per_doc - chunk_words) // (chunk_words - overlap) + 1)
+    for i in range(max(1, chunks // chunks_per_doc)):
+        text = " ".join(rng.choice(VOCABULARY) for _ in range(words_per_doc))
+        (directory / f"doc_{i:06d}.txt").write_text(text, encoding="utf-8")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run(size: int, model: str, queries: int, batch: int):
+    embedder = get_embedder(model)
+    with tempfile.TemporaryDirectory() as tmp:
+        docs, index_dir = Path(tmp) / "docs", Path(tmp) / "index"
+        docs.mkdir()
+        write_corpus(docs, size)
+
+        manifest = build_index([docs], index_dir, embedder)
+        index = KnowledgeIndex(index_dir, embedder=embedder)
+
+        rng = random.Random(7)
+        texts = [" ".join(rng.choice(VOCABULARY) for _ in range(8)) for _ in range(queries)]
+        index.search(texts[:1], k=3)  # warm the page cache and sqlite connection
+
+        single = []
+        for text in texts:
+            started = time.perf_counter()
+            index.search([text], k=3)
+            single.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        for start in range(0, len(texts), batch):
+            index.search(texts[start:start + batch], k=3)
+        batched_per_query = (time.perf_counter() - started) * 1000 / len(texts)
+
+        return {
+            "chunks": manifest["chunks"],
+            "build_s": manifest["build_seconds"],
+            "p50_ms": percentile(single, 50),
+            "p95_ms": percentile(single, 95),
+            "batched_ms": batched_per_query,
+            "embeddings_mb": os.path.getsize(index_dir / EMBEDDINGS_FILE) / 2**20,
+            "metadata_mb": os.path.getsize(index_dir / METADATA_FILE) / 2**20,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="Approximate chunk counts")
+    parser.add_argument("--model", default="hashing")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"{'chunks':>8} {'build s':>8} {'p50 ms':>8} {'p95 ms':>8} {'batch ms/q':>10} {'emb MB':>8} {'meta MB':>8} {'peak RSS MB':>12}")
+    for size in args.sizes:
+        r = run(size, args.model, args.queries, args.batch)
+        print(
+            f"{r['chunks']:>8} {r['build_s']:>8.2f} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} {r['batched_ms']:>10.3f} "
+            f"{r['embeddings_mb']:>8.1f} {r['metadata_mb']:>8.1f} {r['peak_rss_mb']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import os
-import mariadb
 import sys
-from sqlmodel import Session, create_engine
+from sqlmodel import SQLModel, Session, create_engine
+from db.replicas import SessionRouter
 from config import settings
 
 # Use settings from config
@@ -16,11 +16,20 @@ DATABASE_URL = settings.database_url
 
 engine = create_engine(DATABASE_URL, echo=settings.debug)
 
+# Read-only CRUD goes through session_router.read(); writes keep using engine
+session_router = SessionRouter(
+    engine,
+    [create_engine(url, echo=settings.debug, pool_pre_ping=True) for url in settings.replica_urls],
+    read_your_writes_seconds=settings.read_your_writes_seconds,
+    cooldown_seconds=settings.replica_cooldown_seconds,
+)
+
 def get_session():
   with Session(engine) as session:
     yield session
 
 def get_connection():
+  import mariadb
   try:
     conn = mariadb.connect(
         host=DB_HOST,
@@ -34,8 +43,23 @@ def get_connection():
     sys.exit(1)
   return conn
 
+def create_model_tables():
+  """Create the schema of a non-MariaDB database (local/test SQLite) from the SQLModel models.
+
+  Models register themselves when their tasksapi.crud module is imported, and
+  those modules import this one, so this runs from the app startup hook rather
+  than at import time.
+  """
+  if engine.dialect.name in ("mariadb", "mysql"):
+    return
+  SQLModel.metadata.create_all(engine)
+  print("Database initialized from models")
+
 # Initialize the database and create the tasks table if it doesn't exist
 def init_db():
+  if engine.dialect.name not in ("mariadb", "mysql"):
+    # Schema comes from create_model_tables() once the models are loaded
+    return
   conn = get_connection()
   try:
     cursor = conn.cursor()
@@ -72,6 +96,76 @@ def init_db():
         FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
       );
     """)
+
+    cursor.execute("""
+      CREATE TABLE IF NOT EXISTS message_search (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        conversation_id INT NOT NULL,
+        user_id INT NOT NULL,
+        message_index INT NOT NULL,
+        role VARCHAR(32),
+        timestamp VARCHAR(64),
+        content TEXT NOT NULL,
+        INDEX idx_message_search_user (user_id),
+        INDEX idx_message_search_conversation (conversation_id),
+        FULLTEXT INDEX ft_message_search_content (content)
+      ) ENGINE=InnoDB;
+    """)
+
+    # Last write time drives the cold-tier archiver
+    cursor.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NULL DEFAULT NULL")
+    cursor.execute("ALTER TABLE conversations ADD INDEX IF NOT EXISTS idx_conversations_updated_at (updated_at)")
+    cursor.execute("UPDATE conversations SET updated_at = timestamp WHERE updated_at IS NULL")
+
+    cursor.execute("""
+      CREATE TABLE IF NOT EXISTS conversations_archive (
+        conversation_id INT PRIMARY KEY,
+        user_id INT NOT NULL,
+        timestamp TIMESTAMP NULL DEFAULT NULL,
+        updated_at TIMESTAMP NULL DEFAULT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        first_message TEXT NOT NULL,
+        codec VARCHAR(16) NOT NULL,
+        payload LONGBLOB NOT NULL,
+        INDEX idx_conversations_archive_user (user_id),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+      );
+    """)
+
+    cursor.execute("""
+      CREATE TABLE IF NOT EXISTS generation_jobs (
+        job_id CHAR(32) PRIMARY KEY,
+        user_id INT NOT NULL,
+        conversation_id INT NOT NULL,
+        content TEXT NOT NULL,
+        status VARCHAR(16) NOT NULL DEFAULT 'queued',
+        result TEXT,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_generation_jobs_status (status, created_at),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+      );
+    """)
+
+    cursor.execute("""
+      CREATE TABLE IF NOT EXISTS usage_rollups (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        day DATE NOT NULL,
+        user_id INT NOT NULL,
+        conversation_id INT NOT NULL DEFAULT 0,
+        model VARCHAR(64) NOT NULL,
+        requests INT NOT NULL DEFAULT 0,
+        prompt_tokens BIGINT NOT NULL DEFAULT 0,
+        output_tokens BIGINT NOT NULL DEFAULT 0,
+        total_tokens BIGINT NOT NULL DEFAULT 0,
+        ttft_ms DOUBLE NOT NULL DEFAULT 0,
+        total_ms DOUBLE NOT NULL DEFAULT 0,
+        max_total_ms DOUBLE NOT NULL DEFAULT 0,
+        UNIQUE KEY uq_usage_rollups (day, user_id, conversation_id, model),
+        INDEX idx_usage_rollups_user_day (user_id, day)
+      );
+    """)
     
     conn.commit()
     print("Database initialized and tables ensured.")
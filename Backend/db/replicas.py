@@ -0,0 +1,122 @@
+import threading
+import time
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session
+
+
+class _Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.inflight = 0
+        self.reads = 0
+        self.errors = 0
+        self.down_until = 0.0
+        self.last_error = None
+
+
+class SessionRouter:
+    """Send read-only work to replicas and everything else to the primary.
+
+    Reads go to the healthy replica with the fewest reads in flight. A replica
+    that raises a database error is skipped for ``cooldown_seconds`` and the
+    read is retried on the primary. For ``read_your_writes_seconds`` after a
+    user writes, that user's reads stay on the primary so replication lag
+    never hides their own changes. The write log lives in process memory, so
+    with several workers a user may briefly read from a replica through a
+    worker that did not see the write.
+    """
+
+    def __init__(self, primary, replicas=(), read_your_writes_seconds=5.0, cooldown_seconds=30.0):
+        self.primary = primary
+        self.replicas = [_Replica(engine) for engine in replicas]
+        self.window = read_your_writes_seconds
+        self.cooldown = cooldown_seconds
+
+        self._lock = threading.Lock()
+        self._recent_writes = {}
+        self._next = 0
+
+        self._primary_reads = 0
+        self._pinned_reads = 0
+        self._fallbacks = 0
+
+    def record_write(self, user_id=None, username=None):
+        """Pin the user's reads to the primary for the read-your-writes window."""
+        if not self.replicas:
+            return
+        until = time.monotonic() + self.window
+        with self._lock:
+            for key in (("user", user_id), ("username", username)):
+                if key[1] is not None:
+                    self._recent_writes[key] = until
+            if len(self._recent_writes) > 10000:
+                now = time.monotonic()
+                self._recent_writes = {k: t for k, t in self._recent_writes.items() if t > now}
+
+    def read(self, fn, user_id=None, username=None):
+        """Run ``fn(session)`` on a replica, or on the primary when none can serve it."""
+        replica = self._acquire(user_id, username)
+        if replica is not None:
+            try:
+                with Session(replica.engine) as session:
+                    return fn(session)
+            except DBAPIError as e:
+                self._mark_down(replica, e)
+            finally:
+                with self._lock:
+                    replica.inflight -= 1
+            with self._lock:
+                self._fallbacks += 1
+        with self._lock:
+            self._primary_reads += 1
+        with Session(self.primary) as session:
+            return fn(session)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "replicas": [
+                    {
+                        "url": replica.engine.url.render_as_string(hide_password=True),
+                        "healthy": replica.down_until <= now,
+                        "inflight": replica.inflight,
+                        "reads": replica.reads,
+                        "errors": replica.errors,
+                        "last_error": replica.last_error,
+                    }
+                    for replica in self.replicas
+                ],
+                "primary_reads": self._primary_reads,
+                "pinned_reads": self._pinned_reads,
+                "fallbacks": self._fallbacks,
+                "pinned_users": sum(1 for until in self._recent_writes.values() if until > now),
+            }
+
+    def _acquire(self, user_id, username):
+        if not self.replicas:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            for key in (("user", user_id), ("username", username)):
+                if self._recent_writes.get(key, 0) > now:
+                    self._pinned_reads += 1
+                    return None
+            healthy = [replica for replica in self.replicas if replica.down_until <= now]
+            if not healthy:
+                return None
+            # Least in-flight first; rotate the starting point so ties spread evenly
+            self._next = (self._next + 1) % len(healthy)
+            rotated = healthy[self._next:] + healthy[:self._next]
+            replica = min(rotated, key=lambda r: r.inflight)
+            replica.inflight += 1
+            replica.reads += 1
+            return replica
+
+    def _mark_down(self, replica, error):
+        with self._lock:
+            replica.errors += 1
+            replica.down_until = time.monotonic() + self.cooldown
+            replica.last_error = str(error).splitlines()[0][:200]
+        print(f"[replicas] {replica.engine.url.render_as_string(hide_password=True)} failed, "
+              f"skipping it for {self.cooldown:.0f}s: {replica.last_error}")
@@ -0,0 +1,233 @@
+import threading
+import time
+from sqlmodel import Session
+
+
+class WriteBehindQueue:
+    """Collect keyed writes in memory and group-commit them on a background thread.
+
+    Writes for the same key are coalesced with ``merge`` (by default the newest
+    payload wins), so a burst of updates to one row costs a single statement.
+    Every flush applies the whole batch inside one session and one commit.
+
+    If that commit fails, each key is retried in its own session so one bad row
+    cannot hold back the rest. A key that fails ``max_attempts`` flushes in a
+    row is parked: it is still served by ``pending()`` and retried every
+    ``park_retry_seconds``, but no longer holds back the regular flushes.
+    """
+
+    def __init__(self, engine, apply, name="write-behind", interval_ms=5, max_batch=200, merge=None,
+                 max_attempts=3, park_retry_seconds=60.0):
+        self.engine = engine
+        self.apply = apply
+        self.name = name
+        self.interval = interval_ms / 1000.0
+        self.max_batch = max_batch
+        self.merge = merge or (lambda old, new: new)
+        self.max_attempts = max_attempts
+        self.park_retry_seconds = park_retry_seconds
+
+        self._pending = {}
+        self._inflight = {}
+        self._parked = {}
+        self._attempts = {}
+        self._last_park_retry = time.monotonic()
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        self._batches = 0
+        self._rows = 0
+        self._failures = 0
+        self._failed_keys = 0
+        self._last_failed = False
+        self._last_commit_ms = 0.0
+        self._max_commit_ms = 0.0
+        self._total_commit_ms = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        print(f"[{self.name}] started (interval={self.interval * 1000:.0f}ms, max_batch={self.max_batch})")
+
+    def stop(self) -> int:
+        """Stop the writer thread after draining everything still queued.
+
+        Parked keys get one last attempt. Returns the number of writes that
+        could not be committed; they are reported as lost.
+        """
+        with self._lock:
+            self._running = False
+            self._lock.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._unpark()
+        self.flush()
+        with self._lock:
+            lost = {**self._pending, **self._parked}
+        if lost:
+            keys = ", ".join(str(key) for key in list(lost)[:20])
+            print(f"[{self.name}] ERROR: shutdown drain failed, {len(lost)} write(s) were NOT saved and are lost: {keys}")
+        return len(lost)
+
+    def submit(self, key, payload):
+        with self._lock:
+            if key in self._parked:
+                # A new write gets one more attempt instead of waiting for the park retry
+                payload = self.merge(self._parked.pop(key), payload)
+                self._attempts[key] = self.max_attempts - 1
+            if key in self._pending:
+                payload = self.merge(self._pending[key], payload)
+            self._pending[key] = payload
+            if len(self._pending) >= self.max_batch:
+                self._lock.notify_all()
+
+    def pending(self, key):
+        """Return the queued payload for ``key`` so readers can see their own writes."""
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            if key in self._inflight:
+                return self._inflight[key]
+            return self._parked.get(key)
+
+    def discard(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+            self._inflight.pop(key, None)
+            self._parked.pop(key, None)
+            self._attempts.pop(key, None)
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """Commit everything queued so far on the calling thread."""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            # Keep the batch visible to pending() until it is actually committed
+            self._inflight = dict(batch)
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        try:
+            with Session(self.engine) as session:
+                self.apply(session, batch)
+                session.commit()
+        except Exception as e:
+            print(f"[{self.name}] group commit of {len(batch)} row(s) failed, retrying one by one: {e}")
+            self._failures += 1
+            return self._flush_each(batch)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._inflight = {}
+            for key in batch:
+                self._attempts.pop(key, None)
+        self._last_failed = False
+        self._record_commit(len(batch), elapsed_ms)
+        return len(batch)
+
+    def _flush_each(self, batch) -> int:
+        """Commit each key of a failed batch in its own session."""
+        committed = requeued = 0
+        for key, payload in batch.items():
+            started = time.perf_counter()
+            try:
+                with Session(self.engine) as session:
+                    self.apply(session, {key: payload})
+                    session.commit()
+            except Exception as e:
+                self._failed_keys += 1
+                requeued += self._requeue(key, payload, e)
+                continue
+            committed += 1
+            self._record_commit(1, (time.perf_counter() - started) * 1000)
+            with self._lock:
+                self._attempts.pop(key, None)
+                self._inflight.pop(key, None)
+        with self._lock:
+            self._inflight = {}
+        # Nothing went through and keys are waiting to retry: most likely the
+        # database itself is down, so back off
+        self._last_failed = committed == 0 and requeued > 0
+        return committed
+
+    def _requeue(self, key, payload, error) -> bool:
+        """Queue a failed key for another flush, or park it; True when it was queued."""
+        with self._lock:
+            self._inflight.pop(key, None)
+            attempts = self._attempts.get(key, 0) + 1
+            self._attempts[key] = attempts
+            # Keep a newer write for the same key on top of the failed one
+            if key in self._pending:
+                self._pending[key] = self.merge(payload, self._pending[key])
+                return True
+            if attempts < self.max_attempts:
+                self._pending[key] = payload
+                return True
+            self._parked[key] = payload
+            parked = len(self._parked)
+        print(f"[{self.name}] ERROR: write for {key} failed {attempts} time(s), parking it "
+              f"(retried every {self.park_retry_seconds:g}s, {parked} parked): {error}")
+        return False
+
+    def _unpark(self):
+        """Move parked keys back into the queue for another attempt."""
+        with self._lock:
+            self._last_park_retry = time.monotonic()
+            for key, payload in self._parked.items():
+                self._attempts[key] = self.max_attempts - 1
+                if key in self._pending:
+                    payload = self.merge(payload, self._pending[key])
+                self._pending[key] = payload
+            self._parked = {}
+
+    def _record_commit(self, rows, elapsed_ms):
+        self._batches += 1
+        self._rows += rows
+        self._last_commit_ms = elapsed_ms
+        self._max_commit_ms = max(self._max_commit_ms, elapsed_ms)
+        self._total_commit_ms += elapsed_ms
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "queue_depth": self.depth(),
+            "batches_committed": self._batches,
+            "rows_committed": self._rows,
+            "failed_batches": self._failures,
+            "failed_keys": self._failed_keys,
+            "parked_keys": len(self._parked),
+            "last_commit_ms": round(self._last_commit_ms, 3),
+            "max_commit_ms": round(self._max_commit_ms, 3),
+            "avg_commit_ms": round(self._total_commit_ms / self._batches, 3) if self._batches else 0.0,
+            "avg_batch_size": round(self._rows / self._batches, 2) if self._batches else 0.0,
+        }
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._running:
+                    return
+                self._lock.wait(self.interval)
+                if not self._running:
+                    return
+            if self._parked and time.monotonic() - self._last_park_retry >= self.park_retry_seconds:
+                self._unpark()
+            self.flush()
+            # Back off after a failed commit instead of hammering the database
+            if self._last_failed:
+                time.sleep(min(1.0, self.interval * 100))
@@ -1,17 +1,26 @@
-from fastapi import APIRouter, HTTPException, status, Request, Depends
+from fastapi import APIRouter, HTTPException, status, Request, Depends, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, StreamingResponse
 from tasksapi.crud.user import create_user, verify_user_login, get_user_by_username, UserCreate, UserLogin, save_user_token, clear_user_token
-from tasksapi.utils.utils import create_access_token, get_current_user
+from tasksapi.utils.utils import create_access_token, get_current_user, verify_token
 from pydantic import BaseModel
-from tasksapi.crud.conversations import create_conversation, get_conversation, delete_conversation
+from tasksapi.crud.conversations import create_conversation, get_conversation, delete_conversation, save_conversation_messages, iter_user_conversations, list_user_conversations
 from google import genai
 from google.genai import types
 from datetime import datetime
 from db.db import engine
 from sqlmodel import Session, select
 from tasksapi.crud.conversations import Conversation as ConversationModel
-from fastapi import Path
+from tasksapi.crud.search import search_messages
+from tasksapi.utils.triage import triage_message, llm_latency
+from tasksapi.utils.knowledge import retrieve_context, build_prompt
+from tasksapi.crud.usage import record_usage, get_usage_rollups
+from tasksapi.crud.jobs import create_job, get_job_info, FINISHED
+from tasksapi.utils.jobs import JobWorkerPool, JobQueueFull
+from fastapi import Path, Query
 import json
+import re
+import time
+import zlib
 import asyncio
 import os
 from config import settings
@@ -25,6 +34,57 @@ MODEL = settings.gemini_model
 client = genai.Client(api_key=settings.gemini_api_key)
 
 
+def _generate_reply(user_message: str, contents: str, user_id: int = None, conversation_id: int = None):
+    """Answer from the triage rules when one fires, otherwise ask Gemini.
+
+    Returns ``(text, triage_match)``; ``triage_match`` is None for generated replies.
+    Token counts and latency are added to the usage rollups for ``user_id``.
+    """
+    started = time.perf_counter()
+    match = triage_message(user_message)
+    if match:
+        if user_id is not None:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            record_usage(user_id, conversation_id, "triage", ttft_ms=elapsed_ms, total_ms=elapsed_ms)
+        return match.response, match
+
+    # Ground the answer in the local knowledge base when one is configured
+    contents = build_prompt(contents, retrieve_context(user_message))
+
+    generation_started = time.perf_counter()
+    gemini_response = client.models.generate_content(
+        model=MODEL,
+        contents=contents,
+        config=types.GenerateContentConfig()
+    )
+    finished = time.perf_counter()
+    llm_latency.record((finished - generation_started) * 1000)
+
+    if user_id is not None:
+        usage = gemini_response.usage_metadata
+        # generate_content is not streamed, so the first token arrives with the whole reply
+        record_usage(
+            user_id,
+            conversation_id,
+            MODEL,
+            prompt_tokens=getattr(usage, "prompt_token_count", 0),
+            output_tokens=getattr(usage, "candidates_token_count", 0),
+            total_tokens=getattr(usage, "total_token_count", 0),
+            ttft_ms=(finished - started) * 1000,
+            total_ms=(finished - started) * 1000,
+        )
+    return gemini_response.text, None
+
+def _assistant_message(content: str, triage=None) -> dict:
+    message = {
+        "role": "assistant",
+        "content": content,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    if triage:
+        message["triage"] = triage.rule_id
+    return message
+
 async def get_current_user_info(current_user: str = Depends(get_current_user)):
     """Get current user information"""
     try:
@@ -126,35 +186,68 @@ async def get_user_conversations(
         raise HTTPException(status_code=404, detail="User not found")
     
     try:
-        with Session(engine) as session:
-            statement = select(ConversationModel).where(
-                ConversationModel.user_id == user["user_id"]
-            ).order_by(ConversationModel.timestamp.desc())
-            conversations = session.exec(statement).all()
-            
-            result = []
-            for conv in conversations:
-                # Parse messages to get first message
-                messages = json.loads(conv.messages) if conv.messages else []
-                first_message = ""
-                if messages:
-                    # Find first user message
-                    for msg in messages:
-                        if msg.get("role") == "user":
-                            first_message = msg.get("content", "")
-                            break
-                
-                result.append({
-                    "conversation_id": conv.conversation_id,
-                    "user_id": conv.user_id,
-                    "timestamp": conv.timestamp.isoformat(),
-                    "first_message": first_message
-                })
-            
-            return result
+        return list_user_conversations(user["user_id"])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching conversations: {str(e)}")
 
+def _export_lines(user_id):
+    for conversation, messages in iter_user_conversations(user_id):
+        yield json.dumps({"type": "conversation", **conversation}) + "\n"
+        for index, message in enumerate(messages):
+            record = {"type": "message", "conversation_id": conversation["conversation_id"], "index": index, **message}
+            yield json.dumps(record) + "\n"
+
+def _gzip_stream(lines):
+    # wbits=31 produces a gzip container instead of a raw zlib stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for line in lines:
+        chunk = compressor.compress(line.encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+@router.get("/conversations/export")
+async def export_conversations(
+    gzip: bool = False,
+    current_username: str = Depends(get_current_user)
+):
+    """Stream the user's full history as NDJSON: a conversation record followed by its messages."""
+    user = get_user_by_username(current_username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    filename = f"conversations-{user['user_id']}.ndjson"
+    lines = _export_lines(user["user_id"])
+    if gzip:
+        return StreamingResponse(
+            _gzip_stream(lines),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'}
+        )
+    return StreamingResponse(
+        lines,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/conversations/search")
+async def search_conversations(
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0),
+    current_username: str = Depends(get_current_user)
+):
+    user = get_user_by_username(current_username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    try:
+        results = search_messages(user["user_id"], q, limit=limit, offset=offset)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching conversations: {str(e)}")
+
+    return {"query": q, "limit": limit, "offset": offset, "results": results}
+
 @router.post("/conversations", response_model = ConversationResponse)
 async def start_conversation(
     request: ConversationCreateRequest,
@@ -167,28 +260,12 @@ async def start_conversation(
     conv = create_conversation(user_id = user["user_id"], first_message = request.first_message)
 
     try:
-        gemini_response = client.models.generate_content(
-            model=MODEL,
-            contents=request.first_message,
-            config=types.GenerateContentConfig()
+        reply, triage = _generate_reply(
+            request.first_message, request.first_message, user["user_id"], conv["conversation_id"]
         )
+        conv["messages"].append(_assistant_message(reply, triage))
 
-        conv["messages"].append({
-            "role": "assistant",
-            "content": gemini_response.text,
-            "timestamp": datetime.utcnow().isoformat()
-        })
-
-        with Session(engine) as session:
-            statement = select(ConversationModel).where(
-                ConversationModel.conversation_id == conv["conversation_id"],
-                ConversationModel.user_id == user["user_id"]
-            )
-            db_conv = session.exec(statement).first()
-            if db_conv:
-                db_conv.messages = json.dumps(conv["messages"])
-                session.add(db_conv)
-                session.commit()
+        save_conversation_messages(conv["conversation_id"], user["user_id"], conv["messages"])
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini API error: {str(e)}")
@@ -204,7 +281,7 @@ async def read_conversation(
     if not user:
         raise HTTPException(status_code = 404, detail = "User not found")
     
-    conv = get_conversation(conversation_id, user["user_id"])
+    conv = get_conversation(conversation_id, user["user_id"], replica=True)
     if not conv:
         raise HTTPException(status_code = 404, detail = "Conversation not found")
     
@@ -253,28 +330,10 @@ async def add_message_to_conversation(
     history_prompt = "\n".join(f"{m['role']}: {m['content']}" for m in conv["messages"])
     
     try:
-        gemini_response = client.models.generate_content(
-            model=MODEL,
-            contents=history_prompt,
-            config=types.GenerateContentConfig()
-        )
-
-        conv["messages"].append({
-            "role": "assistant",
-            "content": gemini_response.text,
-            "timestamp": datetime.utcnow().isoformat()
-        })
+        reply, triage = _generate_reply(request.content, history_prompt, user["user_id"], conversation_id)
+        conv["messages"].append(_assistant_message(reply, triage))
 
-        with Session(engine) as session:
-            statement = select(ConversationModel).where(
-                ConversationModel.conversation_id == conversation_id,
-                ConversationModel.user_id == user["user_id"]
-            )
-            db_conv = session.exec(statement).first()
-            if db_conv:
-                db_conv.messages = json.dumps(conv["messages"])
-                session.add(db_conv)
-                session.commit()
+        save_conversation_messages(conversation_id, user["user_id"], conv["messages"])
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini API error: {str(e)}")
@@ -324,39 +383,37 @@ async def add_message_to_conversation_stream(
             yield f"data: {json.dumps({'type': 'assistant_start', 'message': assistant_message})}\n\n"
             
             print("[DEBUG] Calling Gemini API with streaming")
-            # Generate streaming response from Gemini
-            config = types.GenerateContentConfig()
-            gemini_response = client.models.generate_content(
-                model=MODEL,
-                contents=history_prompt,
-                config=config
-            )
-            
-            # Since the library doesn't support streaming directly, we'll simulate it
-            response_text = gemini_response.text
+            # Generate streaming response from Gemini (or a triage template)
+            response_text, triage = _generate_reply(request.content, history_prompt, user["user_id"], conversation_id)
+            if triage:
+                assistant_message["triage"] = triage.rule_id
             
             print("[DEBUG] Starting to process chunks from Gemini")
             full_content = ""
             chunk_count = 0
             
-            # Simulate streaming by sending the response in chunks
-            import time
-            words = response_text.split()
-            chunk_size = 3  # Send 3 words at a time
+            if triage:
+                # Triage templates go out unchanged in one chunk, line breaks included
+                chunks = [response_text]
+            else:
+                # Simulate streaming by sending the response 3 words at a time
+                words = response_text.split()
+                chunks = []
+                for i in range(0, len(words), 3):
+                    chunk_text = " ".join(words[i:i + 3])
+                    if i + 3 < len(words):
+                        chunk_text += " "
+                    chunks.append(chunk_text)
             
-            for i in range(0, len(words), chunk_size):
-                chunk_words = words[i:i + chunk_size]
-                chunk_text = " ".join(chunk_words)
-                if i + chunk_size < len(words):
-                    chunk_text += " "
-                
+            for chunk_text in chunks:
                 chunk_count += 1
                 print(f"[DEBUG] Processing chunk {chunk_count}: {chunk_text[:50]}...")
                 full_content += chunk_text
                 yield f"data: {json.dumps({'type': 'assistant_chunk', 'content': chunk_text})}\n\n"
                 
                 # Small delay to simulate streaming
-                await asyncio.sleep(0.1)
+                if not triage:
+                    await asyncio.sleep(0.1)
             
             print(f"[DEBUG] Completed processing {chunk_count} chunks. Full content length: {len(full_content)}")
             
@@ -366,16 +423,7 @@ async def add_message_to_conversation_stream(
             
             print("[DEBUG] Saving to database")
             # Save to database
-            with Session(engine) as session:
-                statement = select(ConversationModel).where(
-                    ConversationModel.conversation_id == conversation_id,
-                    ConversationModel.user_id == user["user_id"]
-                )
-                db_conv = session.exec(statement).first()
-                if db_conv:
-                    db_conv.messages = json.dumps(conv["messages"])
-                    session.add(db_conv)
-                    session.commit()
+            save_conversation_messages(conversation_id, user["user_id"], conv["messages"])
             
             print("[DEBUG] Database save complete, sending completion signals")
             # Send completion signal
@@ -399,3 +447,279 @@ async def add_message_to_conversation_stream(
             "Access-Control-Allow-Headers": "*",
         }
     )
+
+
+def _word_chunks(text: str, chunk_size: int = 3):
+    """Split text into chunks of ``chunk_size`` words, keeping the original whitespace."""
+    words = re.findall(r"\S+\s*", text)
+    for i in range(0, len(words), chunk_size):
+        yield "".join(words[i:i + chunk_size])
+
+async def _run_websocket_turn(conversation_id: int, user: dict, content: str, send):
+    # Re-read every turn: HTTP, SSE, job or other-tab turns may have been saved since the last one
+    conv = await asyncio.to_thread(get_conversation, conversation_id, user["user_id"])
+    if not conv:
+        await send({"type": "error", "error": "Conversation not found"})
+        return
+
+    user_message = {
+        "role": "user",
+        "content": content,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    conv["messages"].append(user_message)
+    await send({"type": "user_message", "message": user_message})
+
+    assistant_message = {
+        "role": "assistant",
+        "content": "",
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    await send({"type": "assistant_start", "message": assistant_message})
+
+    history_prompt = "\n".join(f"{m['role']}: {m['content']}" for m in conv["messages"])
+    try:
+        # Generation blocks, so keep it off the event loop to let heartbeats through
+        reply, triage = await asyncio.to_thread(
+            _generate_reply, content, history_prompt, user["user_id"], conv["conversation_id"]
+        )
+    except Exception as e:
+        await send({"type": "error", "error": f"Gemini API error: {str(e)}"})
+        return
+
+    if triage:
+        assistant_message["triage"] = triage.rule_id
+    # send() blocks while the client's outbound queue is full, pacing the chunks
+    for chunk in _word_chunks(reply):
+        await send({"type": "assistant_chunk", "content": chunk})
+
+    assistant_message["content"] = reply
+    conv["messages"].append(assistant_message)
+    await asyncio.to_thread(save_conversation_messages, conv["conversation_id"], user["user_id"], conv["messages"])
+
+    await send({"type": "assistant_complete", "message": assistant_message})
+    await send({"type": "done"})
+
+@router.websocket("/ws/conversations/{conversation_id}")
+async def conversation_websocket(websocket: WebSocket, conversation_id: int):
+    """Multi-turn chat over one connection.
+
+    The client authenticates once, with ``?token=`` or a first
+    ``{"type": "auth", "token": ...}`` frame, then sends
+    ``{"type": "message", "content": ...}`` frames. The server replies with the
+    same events as the SSE endpoint. It sends ``ping`` heartbeats and closes
+    the connection if the client stays silent for three heartbeat intervals.
+    """
+    await websocket.accept()
+    interval = settings.ws_heartbeat_seconds
+
+    token = websocket.query_params.get("token")
+    if not token:
+        try:
+            first = await asyncio.wait_for(websocket.receive_json(), timeout=interval)
+            token = first.get("token") if first.get("type") == "auth" else None
+        except (asyncio.TimeoutError, WebSocketDisconnect, ValueError, AttributeError):
+            token = None
+
+    try:
+        # JWT verification and the token/user lookups happen once per connection
+        username = get_current_user(token) if token else None
+        expires_at = verify_token(token).get("exp") if username else None
+    except HTTPException:
+        username = None
+    if not username:
+        await websocket.close(code=4401, reason="Not authenticated")
+        return
+
+    user = get_user_by_username(username)
+    conv = get_conversation(conversation_id, user["user_id"]) if user else None
+    if not conv:
+        await websocket.close(code=4404, reason="Conversation not found")
+        return
+
+    outbox = asyncio.Queue(maxsize=settings.ws_send_queue_size)
+    turns = asyncio.Queue(maxsize=settings.ws_max_pending_turns)
+    last_seen = [time.monotonic()]
+
+    async def send(event):
+        await outbox.put(event)
+
+    async def sender():
+        while True:
+            event = await outbox.get()
+            await websocket.send_text(json.dumps(event))
+            outbox.task_done()
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - last_seen[0] > interval * 3:
+                await websocket.close(code=4408, reason="Heartbeat timeout")
+                return
+            await send({"type": "ping", "ts": time.time()})
+
+    async def worker():
+        while True:
+            content = await turns.get()
+            if expires_at and time.time() > expires_at:
+                await send({"type": "error", "error": "Token has expired"})
+                await outbox.join()
+                await websocket.close(code=4401, reason="Token has expired")
+                return
+            try:
+                await _run_websocket_turn(conversation_id, user, content, send)
+            except Exception as e:
+                # Report the failed turn and keep the worker alive for the next one
+                print(f"[ERROR] WebSocket turn failed for conversation {conversation_id}: {str(e)}")
+                await send({"type": "error", "error": f"Error processing message: {str(e)}"})
+
+    tasks = [asyncio.create_task(task()) for task in (sender, heartbeat, worker)]
+    await send({"type": "ready", "conversation_id": conversation_id, "messages": len(conv["messages"])})
+    try:
+        while True:
+            try:
+                data = await websocket.receive_json()
+            except ValueError:
+                await send({"type": "error", "error": "Invalid JSON"})
+                continue
+            last_seen[0] = time.monotonic()
+            kind = data.get("type") if isinstance(data, dict) else None
+            if kind == "message":
+                content = str(data.get("content") or "").strip()
+                if not content:
+                    await send({"type": "error", "error": "Message content is required"})
+                    continue
+                try:
+                    turns.put_nowait(content)
+                except asyncio.QueueFull:
+                    await send({"type": "error", "error": "Too many pending messages, wait for the current reply"})
+            elif kind == "ping":
+                await send({"type": "pong", "ts": data.get("ts")})
+            elif kind in ("pong", "auth"):
+                continue
+            else:
+                await send({"type": "error", "error": f"Unknown message type: {kind}"})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _run_generation_job(job) -> dict:
+    """Worker-side body of a generation job; returns the assistant message."""
+    conv = get_conversation(job.conversation_id, job.user_id)
+    if not conv:
+        raise ValueError("Conversation not found")
+
+    # A job interrupted after saving but before being marked done must not reply twice
+    for i, message in enumerate(conv["messages"]):
+        if message.get("job_id") == job.job_id and i + 1 < len(conv["messages"]):
+            return conv["messages"][i + 1]
+
+    conv["messages"].append({
+        "role": "user",
+        "content": job.content,
+        "timestamp": job.created_at.isoformat(),
+        "job_id": job.job_id
+    })
+    history_prompt = "\n".join(f"{m['role']}: {m['content']}" for m in conv["messages"])
+    reply, triage = _generate_reply(job.content, history_prompt, job.user_id, job.conversation_id)
+    assistant_message = _assistant_message(reply, triage)
+    conv["messages"].append(assistant_message)
+    save_conversation_messages(job.conversation_id, job.user_id, conv["messages"])
+    return assistant_message
+
+job_pool = JobWorkerPool(_run_generation_job, workers=settings.job_workers, queue_size=settings.job_queue_size)
+
+@router.post("/conversations/{conversation_id}/jobs", status_code=202)
+async def create_generation_job(
+    conversation_id: int = Path(...),
+    request: MessageRequest = None,
+    current_username: str = Depends(get_current_user)
+):
+    user = get_user_by_username(current_username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if not get_conversation(conversation_id, user["user_id"]):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    if not job_pool.has_capacity():
+        raise HTTPException(status_code=503, detail="Job queue is full, try again later")
+
+    job = create_job(user["user_id"], conversation_id, request.content)
+    try:
+        job_pool.submit(job["job_id"])
+    except JobQueueFull:
+        # Still persisted as queued; it is picked up again on the next start
+        raise HTTPException(status_code=503, detail="Job queue is full, try again later")
+    return job
+
+@router.get("/jobs/{job_id}")
+async def read_generation_job(
+    job_id: str,
+    current_username: str = Depends(get_current_user)
+):
+    user = get_user_by_username(current_username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    job = get_job_info(job_id, user["user_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}/events")
+async def subscribe_generation_job(
+    job_id: str,
+    current_username: str = Depends(get_current_user)
+):
+    """Server-sent events with the job state on every change, ending once it finishes."""
+    user = get_user_by_username(current_username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if not get_job_info(job_id, user["user_id"]):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def job_events():
+        last_status = None
+        while True:
+            job = await asyncio.to_thread(get_job_info, job_id, user["user_id"])
+            if not job:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield f"data: {json.dumps({'type': 'job', 'job': job})}\n\n"
+            if job["status"] in FINISHED:
+                return
+            # Woken by the worker pool; the timeout doubles as a keep-alive
+            await job_pool.wait_for_update(job_id, timeout=15)
+            yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        job_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    )
+
+@router.get("/usage")
+async def get_usage(
+    days: int = Query(30, ge=1, le=366),
+    group_by: str = Query("day_model"),
+    current_username: str = Depends(get_current_user)
+):
+    """Token and latency rollups for the current user."""
+    user = get_user_by_username(current_username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if group_by not in ("day", "model", "conversation", "day_model"):
+        raise HTTPException(status_code=400, detail="group_by must be one of day, model, conversation, day_model")
+
+    try:
+        rollups = get_usage_rollups(user["user_id"], days=days, group_by=group_by)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching usage: {str(e)}")
+    return {"days": days, "group_by": group_by, "usage": rollups}
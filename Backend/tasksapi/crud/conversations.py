@@ -1,9 +1,21 @@
-from db.db import engine
+from db.db import engine, session_router
+from db.write_behind import WriteBehindQueue
+from tasksapi.crud.search import index_messages, remove_conversation
+from config import settings
 from sqlmodel import SQLModel, Field, Session, select
+import base64
 import json
-from datetime import datetime
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
 from typing import Optional
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 class Conversation(SQLModel, table=True):
     __tablename__ = "conversations"
@@ -11,24 +23,184 @@ class Conversation(SQLModel, table=True):
     user_id: int
     timestamp: str
     messages: str
+    updated_at: Optional[datetime] = None
+
+class ArchivedConversation(SQLModel, table=True):
+    __tablename__ = "conversations_archive"
+    conversation_id: int = Field(primary_key=True)
+    user_id: int
+    timestamp: datetime
+    updated_at: Optional[datetime] = None
+    archived_at: datetime
+    first_message: str
+    codec: str
+    payload: bytes
+
+
+class MessageCodec:
+    """Compress message payloads above a size threshold.
+
+    Stored values stay JSON text for small conversations; larger ones are
+    written as ``"<codec>:" + base64(compressed)`` so they still fit the TEXT
+    column. JSON arrays always start with ``[``, so the prefix is unambiguous
+    and rows written before compression was enabled keep decoding as-is.
+    """
+
+    def __init__(self, codec="zlib", threshold=2048, level=6):
+        if codec == "zstd" and zstandard is None:
+            print("zstandard is not installed, falling back to zlib compression")
+            codec = "zlib"
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level
+        self._lock = threading.Lock()
+        self._raw_bytes = 0
+        self._stored_bytes = 0
+        self._compressed_writes = 0
+        self._plain_writes = 0
+        self._compressed_reads = 0
+        self._plain_reads = 0
+        self._compressed_read_ms = 0.0
+        self._plain_read_ms = 0.0
+
+    def compress(self, data: bytes, codec=None) -> bytes:
+        codec = codec or self.codec
+        if codec == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes, codec: str) -> bytes:
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read zstd-compressed conversations")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def encode(self, messages) -> str:
+        text = json.dumps(messages)
+        raw = text.encode("utf-8")
+        if self.codec != "none" and len(raw) >= self.threshold:
+            stored = f"{self.codec}:" + base64.b64encode(self.compress(raw)).decode("ascii")
+            compressed = True
+        else:
+            stored = text
+            compressed = False
+        with self._lock:
+            self._raw_bytes += len(raw)
+            self._stored_bytes += len(stored)
+            if compressed:
+                self._compressed_writes += 1
+            else:
+                self._plain_writes += 1
+        return stored
+
+    def text(self, stored: str) -> str:
+        """Return the JSON text of a stored payload, decompressing if needed."""
+        if not stored:
+            return "[]"
+        started = time.perf_counter()
+        compressed = not stored.startswith("[")
+        if compressed:
+            codec, _, data = stored.partition(":")
+            stored = self.decompress(base64.b64decode(data), codec).decode("utf-8")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            if compressed:
+                self._compressed_reads += 1
+                self._compressed_read_ms += elapsed_ms
+            else:
+                self._plain_reads += 1
+                self._plain_read_ms += elapsed_ms
+        return stored
+
+    def decode(self, stored: str) -> list:
+        return json.loads(self.text(stored))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "codec": self.codec,
+                "threshold_bytes": self.threshold,
+                "compressed_writes": self._compressed_writes,
+                "plain_writes": self._plain_writes,
+                "raw_bytes_written": self._raw_bytes,
+                "stored_bytes_written": self._stored_bytes,
+                "compression_ratio": round(self._raw_bytes / self._stored_bytes, 3) if self._stored_bytes else 1.0,
+                "compressed_reads": self._compressed_reads,
+                "plain_reads": self._plain_reads,
+                "avg_compressed_read_ms": round(self._compressed_read_ms / self._compressed_reads, 4) if self._compressed_reads else 0.0,
+                "avg_plain_read_ms": round(self._plain_read_ms / self._plain_reads, 4) if self._plain_reads else 0.0,
+            }
+
+message_codec = MessageCodec(
+    codec=settings.compression_codec,
+    threshold=settings.compression_threshold_bytes,
+)
+
+def encode_messages(messages) -> str:
+    return message_codec.encode(messages)
+
+def decode_messages(stored) -> list:
+    return message_codec.decode(stored)
+
+def _first_user_message(messages) -> str:
+    for msg in messages:
+        if msg.get("role") == "user":
+            return msg.get("content", "")
+    return ""
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
 
 def create_conversation(user_id, first_message):
     timestamp = datetime.utcnow().isoformat()
-    messages = json.dumps([{"role": "user", "content": first_message, "timestamp": timestamp}])
+    messages = [{"role": "user", "content": first_message, "timestamp": timestamp}]
     with Session(engine) as session:
-        conversation = Conversation(user_id=user_id, timestamp=timestamp, messages=messages)
+        conversation = Conversation(
+            user_id=user_id,
+            timestamp=timestamp,
+            messages=encode_messages(messages),
+            updated_at=datetime.utcnow()
+        )
         session.add(conversation)
+        session.flush()
+        index_messages(session, conversation.conversation_id, user_id, messages)
+        session_router.record_write(user_id=user_id)
         session.commit()
         session.refresh(conversation)
         return {
             "conversation_id": conversation.conversation_id,
             "user_id": user_id,
             "timestamp": timestamp,
-            "messages": json.loads(messages)
+            "messages": messages
         }
 
-def get_conversation(conversation_id, user_id):
-    with Session(engine) as session:
+def _get_archived(session, conversation_id, user_id):
+    statement = select(ArchivedConversation).where(
+        ArchivedConversation.conversation_id == conversation_id,
+        ArchivedConversation.user_id == user_id
+    )
+    return session.exec(statement).first()
+
+def decode_archived_messages(archived) -> list:
+    """Decompress the payload of a row from the cold table."""
+    return json.loads(message_codec.decompress(archived.payload, archived.codec))
+
+def get_conversation(conversation_id, user_id, replica=False):
+    """Load a conversation with its messages.
+
+    Reads the primary by default, because callers that append a turn save the
+    whole message list back and must not start from a lagging copy. Pure read
+    endpoints pass ``replica=True`` to go through ``session_router``.
+    """
+    # A write may still be waiting in the batched queue; serve it so the
+    # caller never reads an older copy of its own conversation
+    pending = message_writer.pending((conversation_id, user_id))
+
+    def read(session):
         statement = select(Conversation).where(
             Conversation.conversation_id == conversation_id,
             Conversation.user_id == user_id
@@ -39,19 +211,272 @@ def get_conversation(conversation_id, user_id):
                 "conversation_id": result.conversation_id,
                 "user_id": result.user_id,
                 "timestamp": result.timestamp,
-                "messages": json.loads(result.messages)
+                "messages": list(pending) if pending is not None else decode_messages(result.messages)
+            }
+        archived = _get_archived(session, conversation_id, user_id)
+        if archived:
+            return {
+                "conversation_id": archived.conversation_id,
+                "user_id": archived.user_id,
+                "timestamp": archived.timestamp,
+                "messages": list(pending) if pending is not None else decode_archived_messages(archived)
             }
         return None
 
+    if replica:
+        return session_router.read(read, user_id=user_id)
+    with Session(engine) as session:
+        return read(session)
+
+def list_user_conversations(user_id) -> list:
+    """Summaries of all of a user's conversations, newest first, including archived ones."""
+    def read(session):
+        result = []
+        statement = select(Conversation).where(Conversation.user_id == user_id)
+        for conv in session.exec(statement):
+            result.append({
+                "conversation_id": conv.conversation_id,
+                "user_id": conv.user_id,
+                "timestamp": _isoformat(conv.timestamp),
+                "first_message": _first_user_message(decode_messages(conv.messages)),
+            })
+        # The cold table keeps the title so listing never decompresses payloads
+        statement = select(
+            ArchivedConversation.conversation_id,
+            ArchivedConversation.timestamp,
+            ArchivedConversation.first_message
+        ).where(ArchivedConversation.user_id == user_id)
+        for conversation_id, timestamp, first_message in session.exec(statement):
+            result.append({
+                "conversation_id": conversation_id,
+                "user_id": user_id,
+                "timestamp": _isoformat(timestamp),
+                "first_message": first_message,
+            })
+        return result
+
+    result = session_router.read(read, user_id=user_id)
+    result.sort(key=lambda conv: conv["timestamp"], reverse=True)
+    return result
+
+def _iter_json_array(text):
+    """Yield the elements of a JSON array one at a time without building the list."""
+    decoder = json.JSONDecoder()
+    pos = text.find("[") + 1
+    end = len(text)
+    while pos < end:
+        while pos < end and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= end or text[pos] == "]":
+            return
+        item, pos = decoder.raw_decode(text, pos)
+        yield item
+
+def iter_user_conversations(user_id, batch_size=100):
+    """Stream a user's conversations oldest first, decoding messages lazily.
+
+    Rows are fetched through a server-side cursor ``batch_size`` at a time, so
+    memory use does not grow with the number of conversations. Yields
+    ``(conversation, messages)`` where ``messages`` is an iterator. Archived
+    conversations follow the active ones.
+    """
+    with Session(engine) as session:
+        statement = select(Conversation).where(
+            Conversation.user_id == user_id
+        ).order_by(Conversation.conversation_id).execution_options(yield_per=batch_size)
+        for row in session.exec(statement):
+            conversation = {
+                "conversation_id": row.conversation_id,
+                "user_id": row.user_id,
+                "timestamp": _isoformat(row.timestamp),
+            }
+            pending = message_writer.pending((row.conversation_id, user_id))
+            messages = iter(pending) if pending is not None else _iter_json_array(message_codec.text(row.messages))
+            yield conversation, messages
+            # Drop the ORM instance so the identity map doesn't grow with the export
+            session.expunge(row)
+
+        statement = select(ArchivedConversation).where(
+            ArchivedConversation.user_id == user_id
+        ).order_by(ArchivedConversation.conversation_id).execution_options(yield_per=batch_size)
+        for row in session.exec(statement):
+            conversation = {
+                "conversation_id": row.conversation_id,
+                "user_id": row.user_id,
+                "timestamp": _isoformat(row.timestamp),
+            }
+            text = message_codec.decompress(row.payload, row.codec).decode("utf-8")
+            yield conversation, _iter_json_array(text)
+            session.expunge(row)
+
 def delete_conversation(conversation_id, user_id) -> bool:
     with Session(engine) as session:
         statement = select(Conversation).where(
             Conversation.conversation_id == conversation_id,
             Conversation.user_id == user_id
         )
-        conversation = session.exec(statement).first()
+        conversation = session.exec(statement).first() or _get_archived(session, conversation_id, user_id)
         if not conversation:
             return False
+        message_writer.discard((conversation_id, user_id))
+        remove_conversation(session, conversation_id)
         session.delete(conversation)
+        session_router.record_write(user_id=user_id)
         session.commit()
-        return True
\ No newline at end of file
+        return True
+
+def _restore_archived(session, conversation_id, user_id):
+    """Move an archived conversation back to the hot table so it can be written to."""
+    archived = _get_archived(session, conversation_id, user_id)
+    if not archived:
+        return None
+    db_conv = Conversation(
+        conversation_id=archived.conversation_id,
+        user_id=archived.user_id,
+        timestamp=_isoformat(archived.timestamp),
+        messages=encode_messages(decode_archived_messages(archived)),
+        updated_at=archived.updated_at
+    )
+    session.delete(archived)
+    session.add(db_conv)
+    session.flush()
+    return db_conv
+
+def _write_messages(session, conversation_id, user_id, messages):
+    statement = select(Conversation).where(
+        Conversation.conversation_id == conversation_id,
+        Conversation.user_id == user_id
+    )
+    db_conv = session.exec(statement).first() or _restore_archived(session, conversation_id, user_id)
+    if db_conv:
+        stored = decode_messages(db_conv.messages)
+        indexed = len(stored)
+        if messages[:indexed] != stored:
+            # The writer held a stale copy, so stored messages were replaced rather
+            # than extended; rebuild this conversation's index rows to match
+            remove_conversation(session, conversation_id)
+            indexed = 0
+        db_conv.messages = encode_messages(messages)
+        db_conv.updated_at = datetime.utcnow()
+        session.add(db_conv)
+        index_messages(session, conversation_id, user_id, messages, start=indexed)
+
+def _apply_message_batch(session, batch):
+    for (conversation_id, user_id), messages in batch.items():
+        _write_messages(session, conversation_id, user_id, messages)
+
+message_writer = WriteBehindQueue(
+    engine,
+    _apply_message_batch,
+    name="message-writer",
+    interval_ms=settings.persistence_flush_interval_ms,
+    max_batch=settings.persistence_max_batch,
+)
+
+def save_conversation_messages(conversation_id, user_id, messages):
+    """Persist the full message list of a conversation.
+
+    In ``sync`` mode the write is committed before returning. In ``batched``
+    mode it is queued and group-committed with other chats by ``message_writer``.
+    """
+    # Batched writes are served from the queue until they commit, then from the primary
+    session_router.record_write(user_id=user_id)
+    if settings.persistence_mode == "batched":
+        message_writer.submit((conversation_id, user_id), list(messages))
+        return
+    with Session(engine) as session:
+        _write_messages(session, conversation_id, user_id, messages)
+        session.commit()
+
+def archive_inactive_conversations(days, batch_size=500) -> int:
+    """Move conversations untouched for ``days`` into the compressed cold table."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    # Always compress cold rows, using zstd when available
+    codec = "zstd" if zstandard is not None else "zlib"
+    archived = 0
+    while True:
+        with Session(engine) as session:
+            statement = select(Conversation).where(
+                Conversation.updated_at < cutoff
+            ).limit(batch_size)
+            rows = session.exec(statement).all()
+            moved = 0
+            for conv in rows:
+                if message_writer.pending((conv.conversation_id, conv.user_id)) is not None:
+                    continue
+                messages = decode_messages(conv.messages)
+                session.add(ArchivedConversation(
+                    conversation_id=conv.conversation_id,
+                    user_id=conv.user_id,
+                    timestamp=_as_datetime(conv.timestamp),
+                    updated_at=conv.updated_at,
+                    archived_at=datetime.utcnow(),
+                    first_message=_first_user_message(messages),
+                    codec=codec,
+                    payload=message_codec.compress(json.dumps(messages).encode("utf-8"), codec)
+                ))
+                session.delete(conv)
+                moved += 1
+            session.commit()
+        archived += moved
+        if len(rows) < batch_size or not moved:
+            return archived
+
+
+class ConversationArchiver:
+    """Periodically run ``archive_inactive_conversations`` on a background thread."""
+
+    def __init__(self, days, interval_minutes=60):
+        self.days = days
+        self.interval = interval_minutes * 60
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.last_archived = 0
+        self.total_archived = 0
+        self.last_duration_ms = 0.0
+
+    def start(self):
+        if self._thread or self.days <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="conversation-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self) -> int:
+        started = time.perf_counter()
+        self.last_archived = archive_inactive_conversations(self.days)
+        self.last_duration_ms = (time.perf_counter() - started) * 1000
+        self.total_archived += self.last_archived
+        self.last_run = datetime.utcnow().isoformat()
+        print(f"Archived {self.last_archived} conversation(s) in {self.last_duration_ms:.0f}ms")
+        return self.last_archived
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.days > 0,
+            "archive_after_days": self.days,
+            "last_run": self.last_run,
+            "last_archived": self.last_archived,
+            "total_archived": self.total_archived,
+            "last_duration_ms": round(self.last_duration_ms, 3),
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Conversation archiving failed: {e}")
+            self._stop.wait(self.interval)
+
+conversation_archiver = ConversationArchiver(
+    days=settings.archive_after_days,
+    interval_minutes=settings.archive_interval_minutes,
+)
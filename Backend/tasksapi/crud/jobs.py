@@ -0,0 +1,76 @@
+from db.db import engine
+from sqlmodel import SQLModel, Field, Session, select
+from datetime import datetime
+from typing import Optional
+import json
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class GenerationJob(SQLModel, table=True):
+    __tablename__ = "generation_jobs"
+    job_id: str = Field(primary_key=True)
+    user_id: int
+    conversation_id: int
+    content: str
+    status: str = QUEUED
+    result: Optional[str] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+
+def _to_dict(job: GenerationJob) -> dict:
+    return {
+        "job_id": job.job_id,
+        "conversation_id": job.conversation_id,
+        "status": job.status,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+def create_job(user_id, conversation_id, content) -> dict:
+    with Session(engine) as session:
+        job = GenerationJob(job_id=uuid.uuid4().hex, user_id=user_id, conversation_id=conversation_id, content=content)
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+        return _to_dict(job)
+
+def get_job(job_id, user_id=None) -> Optional[GenerationJob]:
+    with Session(engine) as session:
+        statement = select(GenerationJob).where(GenerationJob.job_id == job_id)
+        if user_id is not None:
+            statement = statement.where(GenerationJob.user_id == user_id)
+        return session.exec(statement).first()
+
+def get_job_info(job_id, user_id) -> Optional[dict]:
+    job = get_job(job_id, user_id)
+    return _to_dict(job) if job else None
+
+def update_job(job_id, status, result=None, error=None) -> bool:
+    with Session(engine) as session:
+        job = session.get(GenerationJob, job_id)
+        if not job:
+            return False
+        job.status = status
+        job.result = json.dumps(result) if result is not None else job.result
+        job.error = error
+        job.updated_at = datetime.utcnow()
+        session.add(job)
+        session.commit()
+        return True
+
+def get_unfinished_job_ids() -> list:
+    """Jobs that were queued or running when the process stopped, oldest first."""
+    with Session(engine) as session:
+        statement = select(GenerationJob.job_id).where(
+            GenerationJob.status.in_([QUEUED, RUNNING])
+        ).order_by(GenerationJob.created_at)
+        return list(session.exec(statement).all())
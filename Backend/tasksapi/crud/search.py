@@ -0,0 +1,257 @@
+from db.db import engine
+from sqlalchemy import text
+from sqlmodel import Session, select
+from collections import defaultdict
+import math
+import re
+import threading
+
+# Index of individual messages, kept in step with the conversations table.
+# MariaDB uses a FULLTEXT index (created in db.init_db), SQLite uses an FTS5
+# virtual table and anything else falls back to an in-process inverted index.
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+SNIPPET_WIDTH = 160
+
+
+def _tokenize(value: str) -> list:
+    return [t.lower() for t in TOKEN_RE.findall(value or "")]
+
+
+def _create_fts5_table() -> bool:
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+                    content,
+                    conversation_id UNINDEXED,
+                    user_id UNINDEXED,
+                    message_index UNINDEXED,
+                    role UNINDEXED,
+                    timestamp UNINDEXED
+                )
+            """))
+        return True
+    except Exception as e:
+        print(f"FTS5 unavailable, using in-process search index: {e}")
+        return False
+
+
+def _detect_backend() -> str:
+    dialect = engine.dialect.name
+    if dialect in ("mariadb", "mysql"):
+        return "fulltext"
+    if dialect == "sqlite" and _create_fts5_table():
+        return "fts5"
+    return "memory"
+
+
+class InvertedIndex:
+    """Minimal in-process inverted index with BM25 ranking."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(dict)   # token -> {doc_key: term frequency}
+        self._docs = {}                      # doc_key -> (user_id, role, timestamp, content, length)
+        self._by_conversation = defaultdict(set)
+        self._total_length = 0
+        self.loaded_users = set()
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._docs.clear()
+            self._by_conversation.clear()
+            self._total_length = 0
+            self.loaded_users.clear()
+
+    def add(self, conversation_id, user_id, message_index, role, timestamp, content):
+        key = (conversation_id, message_index)
+        tokens = _tokenize(content)
+        with self._lock:
+            if key in self._docs:
+                return
+            self._docs[key] = (user_id, role, timestamp, content, len(tokens))
+            self._by_conversation[conversation_id].add(key)
+            self._total_length += len(tokens)
+            for token in tokens:
+                self._postings[token][key] = self._postings[token].get(key, 0) + 1
+
+    def remove_conversation(self, conversation_id):
+        with self._lock:
+            for key in self._by_conversation.pop(conversation_id, ()):
+                user_id, role, timestamp, content, length = self._docs.pop(key)
+                self._total_length -= length
+                for token in set(_tokenize(content)):
+                    postings = self._postings.get(token)
+                    if postings is not None:
+                        postings.pop(key, None)
+                        if not postings:
+                            del self._postings[token]
+
+    def search(self, user_id, terms, limit, offset):
+        with self._lock:
+            n = len(self._docs) or 1
+            avg_length = (self._total_length / n) or 1
+            scores = defaultdict(float)
+            for term in set(terms):
+                postings = self._postings.get(term, {})
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    doc = self._docs[key]
+                    if doc[0] != user_id:
+                        continue
+                    norm = tf + self.K1 * (1 - self.B + self.B * doc[4] / avg_length)
+                    scores[key] += idf * tf * (self.K1 + 1) / norm
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            page = ranked[offset:offset + limit]
+            return [(key, score, self._docs[key]) for key, score in page]
+
+
+memory_index = InvertedIndex()
+BACKEND = _detect_backend()
+
+
+def index_messages(session, conversation_id, user_id, messages, start=0):
+    """Add ``messages[start:]`` of a conversation to the search index."""
+    new_messages = list(enumerate(messages))[start:]
+    if not new_messages:
+        return
+    if BACKEND == "memory":
+        for index, message in new_messages:
+            memory_index.add(conversation_id, user_id, index, message.get("role"), message.get("timestamp"), message.get("content", ""))
+        return
+    session.execute(
+        text("""
+            INSERT INTO message_search (conversation_id, user_id, message_index, role, timestamp, content)
+            VALUES (:conversation_id, :user_id, :message_index, :role, :timestamp, :content)
+        """),
+        [
+            {
+                "conversation_id": conversation_id,
+                "user_id": user_id,
+                "message_index": index,
+                "role": message.get("role"),
+                "timestamp": message.get("timestamp"),
+                "content": message.get("content", ""),
+            }
+            for index, message in new_messages
+        ],
+    )
+
+
+def remove_conversation(session, conversation_id):
+    if BACKEND == "memory":
+        memory_index.remove_conversation(conversation_id)
+        return
+    session.execute(
+        text("DELETE FROM message_search WHERE conversation_id = :conversation_id"),
+        {"conversation_id": conversation_id},
+    )
+
+
+def _snippet(content: str, terms: list) -> str:
+    """Cut a window of ``content`` around the first matching term and bold the matches."""
+    lowered = content.lower()
+    first = min((lowered.find(t) for t in terms if t in lowered), default=0)
+    start = max(0, first - SNIPPET_WIDTH // 3)
+    window = content[start:start + SNIPPET_WIDTH]
+    if terms:
+        pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in terms) + r")\w*", re.IGNORECASE)
+        window = pattern.sub(lambda m: f"**{m.group(0)}**", window)
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if start + SNIPPET_WIDTH < len(content) else ""
+    return prefix + window + suffix
+
+
+def _load_user_into_memory(user_id):
+    from tasksapi.crud.conversations import iter_user_conversations
+    if user_id in memory_index.loaded_users:
+        return
+    # Local fallback: backfill the user's history on first search
+    for conversation, messages in iter_user_conversations(user_id):
+        index_messages(None, conversation["conversation_id"], user_id, list(messages))
+    memory_index.loaded_users.add(user_id)
+
+
+def search_messages(user_id, query, limit=20, offset=0) -> list:
+    """Return ranked snippets of the user's messages matching ``query``."""
+    terms = _tokenize(query)
+    if not terms:
+        return []
+    if BACKEND == "memory":
+        _load_user_into_memory(user_id)
+        hits = memory_index.search(user_id, terms, limit, offset)
+        return [
+            {
+                "conversation_id": conversation_id,
+                "message_index": message_index,
+                "role": role,
+                "timestamp": timestamp,
+                "snippet": _snippet(content, terms),
+                "score": round(score, 4),
+            }
+            for (conversation_id, message_index), score, (_, role, timestamp, content, _length) in hits
+        ]
+
+    params = {"user_id": user_id, "limit": limit, "offset": offset}
+    if BACKEND == "fulltext":
+        params["query"] = " ".join(terms)
+        statement = text("""
+            SELECT conversation_id, message_index, role, timestamp, content,
+                   MATCH(content) AGAINST (:query IN NATURAL LANGUAGE MODE) AS score
+            FROM message_search
+            WHERE user_id = :user_id AND MATCH(content) AGAINST (:query IN NATURAL LANGUAGE MODE)
+            ORDER BY score DESC
+            LIMIT :limit OFFSET :offset
+        """)
+    else:
+        # Quote every term so user input can't inject FTS5 query syntax
+        params["query"] = " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        statement = text("""
+            SELECT conversation_id, message_index, role, timestamp, content,
+                   -bm25(message_search) AS score
+            FROM message_search
+            WHERE message_search MATCH :query AND user_id = :user_id
+            ORDER BY bm25(message_search)
+            LIMIT :limit OFFSET :offset
+        """)
+
+    with Session(engine) as session:
+        rows = session.execute(statement, params).all()
+    return [
+        {
+            "conversation_id": int(row.conversation_id),
+            "message_index": int(row.message_index),
+            "role": row.role,
+            "timestamp": row.timestamp,
+            "snippet": _snippet(row.content or "", terms),
+            "score": round(float(row.score), 4),
+        }
+        for row in rows
+    ]
+
+
+def rebuild_search_index():
+    """Re-index every stored conversation, e.g. after enabling search on an existing database."""
+    if BACKEND == "memory":
+        memory_index.clear()
+        return 0
+    from tasksapi.crud.conversations import Conversation, ArchivedConversation, decode_messages, decode_archived_messages
+    count = 0
+    with Session(engine) as session:
+        session.execute(text("DELETE FROM message_search"))
+        for conv in session.exec(select(Conversation)).all():
+            index_messages(session, conv.conversation_id, conv.user_id, decode_messages(conv.messages))
+            count += 1
+        for conv in session.exec(select(ArchivedConversation)).all():
+            index_messages(session, conv.conversation_id, conv.user_id, decode_archived_messages(conv))
+            count += 1
+        session.commit()
+    return count
+
+if __name__ == "__main__":
+    print(f"Re-indexed {rebuild_search_index()} conversation(s)")
@@ -0,0 +1,132 @@
+from db.db import engine
+from db.write_behind import WriteBehindQueue
+from config import settings
+from sqlalchemy import UniqueConstraint, func, text
+from sqlmodel import SQLModel, Field, Session, select
+from datetime import date, datetime, timedelta
+from typing import Optional
+import argparse
+
+COUNTERS = ("requests", "prompt_tokens", "output_tokens", "total_tokens", "ttft_ms", "total_ms")
+
+
+class UsageRollup(SQLModel, table=True):
+    """Per day, user, conversation and model totals of generation cost and latency."""
+    __tablename__ = "usage_rollups"
+    __table_args__ = (UniqueConstraint("day", "user_id", "conversation_id", "model"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    day: date
+    user_id: int
+    conversation_id: int
+    model: str
+    requests: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+    ttft_ms: float = 0.0
+    total_ms: float = 0.0
+    max_total_ms: float = 0.0
+
+def _merge(old: dict, new: dict) -> dict:
+    merged = {name: old[name] + new[name] for name in COUNTERS}
+    merged["max_total_ms"] = max(old["max_total_ms"], new["max_total_ms"])
+    return merged
+
+def _upsert_statement():
+    columns = ("day", "user_id", "conversation_id", "model") + COUNTERS + ("max_total_ms",)
+    insert = f"INSERT INTO usage_rollups ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"
+    if engine.dialect.name in ("mariadb", "mysql"):
+        updates = [f"{c} = {c} + VALUES({c})" for c in COUNTERS]
+        updates.append("max_total_ms = GREATEST(max_total_ms, VALUES(max_total_ms))")
+        return text(f"{insert} ON DUPLICATE KEY UPDATE {', '.join(updates)}")
+    updates = [f"{c} = {c} + excluded.{c}" for c in COUNTERS]
+    updates.append("max_total_ms = MAX(max_total_ms, excluded.max_total_ms)")
+    return text(f"{insert} ON CONFLICT (day, user_id, conversation_id, model) DO UPDATE SET {', '.join(updates)}")
+
+UPSERT = _upsert_statement()
+
+def _apply_usage_batch(session, batch):
+    rows = []
+    for (day, user_id, conversation_id, model), counters in batch.items():
+        rows.append({"day": day, "user_id": user_id, "conversation_id": conversation_id, "model": model, **counters})
+    session.execute(UPSERT, rows)
+
+usage_writer = WriteBehindQueue(
+    engine,
+    _apply_usage_batch,
+    name="usage-writer",
+    interval_ms=settings.usage_flush_interval_ms,
+    max_batch=settings.persistence_max_batch,
+    merge=_merge,
+)
+
+def record_usage(user_id, conversation_id, model, prompt_tokens=0, output_tokens=0, total_tokens=0, ttft_ms=0.0, total_ms=0.0):
+    """Add one generation to the in-memory rollup; it is upserted on the next flush."""
+    key = (date.today().isoformat(), user_id, conversation_id or 0, model)
+    usage_writer.submit(key, {
+        "requests": 1,
+        "prompt_tokens": prompt_tokens or 0,
+        "output_tokens": output_tokens or 0,
+        "total_tokens": total_tokens or (prompt_tokens or 0) + (output_tokens or 0),
+        "ttft_ms": ttft_ms,
+        "total_ms": total_ms,
+        "max_total_ms": total_ms,
+    })
+
+GROUPINGS = {
+    "day": (UsageRollup.day,),
+    "model": (UsageRollup.model,),
+    "conversation": (UsageRollup.conversation_id,),
+    "day_model": (UsageRollup.day, UsageRollup.model),
+    "user": (UsageRollup.user_id,),
+    "user_day_model": (UsageRollup.user_id, UsageRollup.day, UsageRollup.model),
+}
+
+def get_usage_rollups(user_id=None, days=30, group_by="day_model", limit=None) -> list:
+    """Aggregate usage since ``days`` ago, optionally for a single user."""
+    keys = GROUPINGS[group_by]
+    requests = func.sum(UsageRollup.requests)
+    total_ms = func.sum(UsageRollup.total_ms)
+    statement = select(
+        *keys,
+        requests,
+        func.sum(UsageRollup.prompt_tokens),
+        func.sum(UsageRollup.output_tokens),
+        func.sum(UsageRollup.total_tokens),
+        func.sum(UsageRollup.ttft_ms),
+        total_ms,
+        func.max(UsageRollup.max_total_ms),
+    ).where(UsageRollup.day >= date.today() - timedelta(days=days)).group_by(*keys)
+    if user_id is not None:
+        statement = statement.where(UsageRollup.user_id == user_id)
+    statement = statement.order_by(func.sum(UsageRollup.total_tokens).desc())
+    if limit:
+        statement = statement.limit(limit)
+
+    result = []
+    with Session(engine) as session:
+        for row in session.exec(statement):
+            group = {key.key: (value.isoformat() if isinstance(value, date) else value) for key, value in zip(keys, row)}
+            count, prompt, output, total, ttft, elapsed, max_elapsed = row[len(keys):]
+            count = int(count or 0)
+            result.append({
+                **group,
+                "requests": count,
+                "prompt_tokens": int(prompt or 0),
+                "output_tokens": int(output or 0),
+                "total_tokens": int(total or 0),
+                "avg_ttft_ms": round(float(ttft or 0) / count, 1) if count else 0.0,
+                "avg_total_ms": round(float(elapsed or 0) / count, 1) if count else 0.0,
+                "max_total_ms": round(float(max_elapsed or 0), 1),
+            })
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show generation usage rollups")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--group-by", choices=sorted(GROUPINGS), default="user_day_model")
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+    for row in get_usage_rollups(days=args.days, group_by=args.group_by, limit=args.limit):
+        print(row)
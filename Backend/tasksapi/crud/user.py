@@ -1,5 +1,5 @@
 from sqlmodel import Session, select, SQLModel, Field, delete
-from db.db import engine
+from db.db import engine, session_router
 import bcrypt
 from typing import Optional
 from datetime import datetime, timedelta
@@ -45,6 +45,7 @@ def create_user(user: UserCreate) -> dict:
             emailaddress=user.emailaddress
         )
         session.add(db_user)
+        session_router.record_write(username=user.username)
         session.commit()
         session.refresh(db_user)
         print(f"User created successfully with ID: {db_user.id}")
@@ -53,7 +54,8 @@ def create_user(user: UserCreate) -> dict:
 def get_user_by_username(username: str) -> dict | None:
     print(f"Looking for user: {username}")
     cleanup_expired_tokens()
-    with Session(engine) as session:
+
+    def read(session):
         statement = select(User).where(User.username == username)
         result = session.exec(statement).first()
         if result:
@@ -67,6 +69,8 @@ def get_user_by_username(username: str) -> dict | None:
         print(f"No user found in database: {username}")
         return None
 
+    return session_router.read(read, username=username)
+
 def verify_user_login(username: str, password: str) -> dict | None:
     print(f"Attempting login for username: {username}")
     cleanup_expired_tokens()
@@ -101,7 +105,8 @@ def cleanup_expired_tokens() -> bool:
 def get_user_token(user_id: int) -> str | None:
     print(f"Getting token for user_id: {user_id}")
     cleanup_expired_tokens()
-    with Session(engine) as session:
+
+    def read(session):
         now = datetime.utcnow()
         statement = select(UserToken).where(
             UserToken.user_id == user_id,
@@ -115,6 +120,8 @@ def get_user_token(user_id: int) -> str | None:
         print(f"No active token found for user_id: {user_id}")
         return None
 
+    return session_router.read(read, user_id=user_id)
+
 def save_user_token(user_id: int, token: str) -> bool:
     print(f"Saving token for user_id: {user_id}")
     cleanup_expired_tokens()
@@ -123,6 +130,7 @@ def save_user_token(user_id: int, token: str) -> bool:
         expires_at = datetime.utcnow() + timedelta(days=1)
         user_token = UserToken(user_id=user_id, token=token, expires_at=expires_at)
         session.add(user_token)
+        session_router.record_write(user_id=user_id)
         session.commit()
         print(f"Token saved successfully in user_tokens table: True")
         return True
@@ -135,6 +143,7 @@ def clear_user_token(user_id: int) -> bool:
         tokens = session.exec(statement).all()
         for token in tokens:
             session.delete(token)
+        session_router.record_write(user_id=user_id)
         session.commit()
         print(f"Deleted token(s) for user_id: {user_id}")
         return True
@@ -150,6 +159,7 @@ def update_user(user_id: int, user: UserUpdate) -> dict:
             db_user.password = password_hash
             db_user.emailaddress = user.emailaddress
             session.add(db_user)
+            session_router.record_write(user_id=user_id, username=db_user.username)
             session.commit()
             print(f"User updated successfully: True")
             return {"updated": True}
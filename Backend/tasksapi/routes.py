@@ -9,7 +9,14 @@ router.post("/logout")(logout_user)
 router.get("/me")(get_current_user_info)
 router.get("/conversations")(get_user_conversations)
 router.post("/conversations")(start_conversation) 
+router.get("/conversations/export")(export_conversations)
+router.get("/conversations/search")(search_conversations)
 router.get("/conversations/{conversation_id}")(read_conversation)
 router.delete("/conversations/{conversation_id}")(delete_conversation_endpoint)
 router.post("/conversations/{conversation_id}/messages")(add_message_to_conversation)
 router.post("/conversations/{conversation_id}/messages/stream")(add_message_to_conversation_stream)
+router.post("/conversations/{conversation_id}/jobs", status_code=202)(create_generation_job)
+router.get("/jobs/{job_id}")(read_generation_job)
+router.get("/jobs/{job_id}/events")(subscribe_generation_job)
+router.get("/usage")(get_usage)
+router.websocket("/ws/conversations/{conversation_id}")(conversation_websocket)
@@ -0,0 +1,119 @@
+import asyncio
+from tasksapi.crud.jobs import get_unfinished_job_ids, get_job, update_job, RUNNING, SUCCEEDED, FAILED
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobWorkerPool:
+    """Bounded asyncio queue of job ids drained by a fixed number of workers.
+
+    Each job runs ``handler(job)`` in a thread and its status is written back
+    to ``generation_jobs``. Queued and running jobs are picked up again on
+    ``start()``, so work accepted before a restart is not lost.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=100):
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue = None
+        self._tasks = []
+        self._waiters = {}
+        self._conversation_locks = {}
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        recovered = get_unfinished_job_ids()
+        if recovered:
+            print(f"[jobs] re-queueing {len(recovered)} unfinished job(s)")
+            # Recovery may exceed the queue bound, so feed it without blocking startup
+            self._tasks.append(asyncio.create_task(self._requeue(recovered)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job_id):
+        if self._queue is None:
+            raise JobQueueFull("Job workers are not running")
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            raise JobQueueFull("Job queue is full")
+
+    def has_capacity(self) -> bool:
+        return self._queue is not None and not self._queue.full()
+
+    async def wait_for_update(self, job_id, timeout):
+        """Block until the job changes state or ``timeout`` seconds pass."""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(job_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[job_id]
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
+
+    def _notify(self, job_id):
+        for waiter in self._waiters.get(job_id, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _requeue(self, job_ids):
+        for job_id in job_ids:
+            await self._queue.put(job_id)
+
+    async def _worker(self, index):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"[jobs] worker {index} failed on {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id):
+        job = await asyncio.to_thread(get_job, job_id)
+        if not job or job.status in (SUCCEEDED, FAILED):
+            return
+        # Turns of the same conversation run one at a time so replies don't overwrite each other
+        entry = self._conversation_locks.setdefault(job.conversation_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._execute(job)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._conversation_locks[job.conversation_id]
+
+    async def _execute(self, job):
+        job_id = job.job_id
+        await asyncio.to_thread(update_job, job_id, RUNNING)
+        self._notify(job_id)
+        try:
+            result = await asyncio.to_thread(self.handler, job)
+            await asyncio.to_thread(update_job, job_id, SUCCEEDED, result)
+        except Exception as e:
+            await asyncio.to_thread(update_job, job_id, FAILED, None, str(e))
+        finally:
+            self._notify(job_id)
+
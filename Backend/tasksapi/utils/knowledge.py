@@ -0,0 +1,278 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+from pathlib import Path
+from typing import Optional
+from config import settings
+
+# Local knowledge base for retrieval-augmented answers. An index directory holds:
+#   embeddings.npy  - float32 matrix (chunks x dim), opened memory-mapped
+#   chunks.sqlite3  - chunk text and source metadata, row i = embedding i
+#   manifest.json   - embedder name, dimension and chunk count
+
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "chunks.sqlite3"
+MANIFEST_FILE = "manifest.json"
+DOCUMENT_SUFFIXES = {".txt", ".md", ".markdown"}
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from had has have how i if in is it its "
+    "me my of on or should so than that the their them then there these they this to was "
+    "we were what when which who will with would you your".split()
+)
+
+
+def chunk_text(text: str, chunk_words: int = 180, overlap: int = 40) -> list:
+    """Split text into overlapping windows of roughly ``chunk_words`` words."""
+    words = text.split()
+    if not words:
+        return []
+    step = max(chunk_words - overlap, 1)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+class HashingEmbedder:
+    """Dependency-free embedder: signed feature hashing of word unigrams and bigrams.
+
+    Stopwords are dropped so that collisions with them don't drown out the
+    content words in short queries.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _features(self, text):
+        tokens = [t for t in (t.lower() for t in TOKEN_RE.findall(text)) if t not in STOPWORDS]
+        yield from tokens
+        yield from (f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+
+    def embed(self, texts) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dim] += 1.0 if value >> 63 else -1.0
+        return _normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """Wrapper around a local sentence-transformers model (optional dependency)."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts) -> np.ndarray:
+        vectors = self.model.encode(list(texts), batch_size=64, convert_to_numpy=True)
+        return _normalize(vectors.astype(np.float32))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def get_embedder(name: str, dim: Optional[int] = None):
+    if name == HashingEmbedder.name:
+        return HashingEmbedder(dim) if dim else HashingEmbedder()
+    return SentenceTransformerEmbedder(name)
+
+
+def _iter_documents(paths):
+    for path in paths:
+        path = Path(path)
+        files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+        for file in files:
+            if file.suffix.lower() in DOCUMENT_SUFFIXES:
+                yield file
+
+
+def build_index(paths, out_dir, embedder, chunk_words=180, overlap=40, batch_size=256) -> dict:
+    """Chunk and embed every document under ``paths`` into a fresh index in ``out_dir``.
+
+    Chunks are written to the metadata store first so embeddings can be
+    streamed into a pre-sized memory-mapped file without holding the corpus
+    in memory.
+    """
+    started = time.perf_counter()
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    for name in (EMBEDDINGS_FILE, METADATA_FILE, MANIFEST_FILE):
+        if (out / name).exists():
+            (out / name).unlink()
+
+    db = sqlite3.connect(out / METADATA_FILE)
+    db.execute("""
+        CREATE TABLE chunks (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            text TEXT NOT NULL
+        )
+    """)
+    count = 0
+    documents = 0
+    for file in _iter_documents(paths):
+        documents += 1
+        text = file.read_text(encoding="utf-8", errors="ignore")
+        rows = [(count + i, str(file), i, chunk) for i, chunk in enumerate(chunk_text(text, chunk_words, overlap))]
+        db.executemany("INSERT INTO chunks (id, source, chunk_index, text) VALUES (?, ?, ?, ?)", rows)
+        count += len(rows)
+    db.commit()
+
+    embeddings = np.lib.format.open_memmap(out / EMBEDDINGS_FILE, mode="w+", dtype=np.float32, shape=(count, embedder.dim))
+    for start in range(0, count, batch_size):
+        texts = [row[0] for row in db.execute(
+            "SELECT text FROM chunks WHERE id >= ? AND id < ? ORDER BY id", (start, start + batch_size)
+        )]
+        embeddings[start:start + len(texts)] = embedder.embed(texts)
+    embeddings.flush()
+    del embeddings
+    db.close()
+
+    manifest = {"embedder": embedder.name, "dim": embedder.dim, "chunks": count, "documents": documents}
+    (out / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    manifest["build_seconds"] = round(time.perf_counter() - started, 3)
+    return manifest
+
+
+class KnowledgeIndex:
+    """Read side of an index directory: memory-mapped embeddings plus chunk metadata."""
+
+    def __init__(self, path, embedder=None, block_rows=16384):
+        self.path = Path(path)
+        self.manifest = json.loads((self.path / MANIFEST_FILE).read_text(encoding="utf-8"))
+        self.embedder = embedder or get_embedder(self.manifest["embedder"], self.manifest["dim"])
+        if self.embedder.dim != self.manifest["dim"]:
+            raise ValueError(f"Embedder dimension {self.embedder.dim} does not match index dimension {self.manifest['dim']}")
+        self.embeddings = np.load(self.path / EMBEDDINGS_FILE, mmap_mode="r")
+        self.block_rows = block_rows
+        self._local = threading.local()
+
+    def _db(self):
+        # sqlite3 connections can't be shared across threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(f"file:{self.path / METADATA_FILE}?mode=ro", uri=True)
+            self._local.db = db
+        return db
+
+    def search_vectors(self, queries: np.ndarray, k: int):
+        """Exact top-k by cosine similarity for a batch of normalized query vectors.
+
+        The matrix is scanned in blocks so only ``block_rows`` rows of the
+        memory map are paged in per step. Returns ``(scores, ids)`` arrays of
+        shape ``(len(queries), k)``, best first.
+        """
+        total = self.embeddings.shape[0]
+        k = min(k, total)
+        if k == 0:
+            return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(queries), k), dtype=np.int64)
+        for start in range(0, total, self.block_rows):
+            block = np.asarray(self.embeddings[start:start + self.block_rows])
+            scores = queries @ block.T
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_ids = np.concatenate([best_ids, np.arange(start, start + len(block))[None, :].repeat(len(queries), axis=0)], axis=1)
+            top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(merged_scores, top, axis=1)
+            best_ids = np.take_along_axis(merged_ids, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+
+    def search(self, queries, k: int = 3, min_score: float = 0.0) -> list:
+        """Return, for each query string, its best chunks as dicts."""
+        if not queries or self.embeddings.shape[0] == 0:
+            return [[] for _ in queries]
+        scores, ids = self.search_vectors(self.embedder.embed(queries), k)
+        db = self._db()
+        results = []
+        for row_scores, row_ids in zip(scores, ids):
+            hits = []
+            for score, chunk_id in zip(row_scores, row_ids):
+                if score < min_score:
+                    continue
+                source, chunk_index, text = db.execute(
+                    "SELECT source, chunk_index, text FROM chunks WHERE id = ?", (int(chunk_id),)
+                ).fetchone()
+                hits.append({"id": int(chunk_id), "source": source, "chunk_index": chunk_index, "text": text, "score": round(float(score), 4)})
+            results.append(hits)
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_knowledge_index() -> Optional[KnowledgeIndex]:
+    """The configured index, opened on first use; None when retrieval is disabled."""
+    global _index
+    if not settings.knowledge_base_path:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = KnowledgeIndex(settings.knowledge_base_path)
+                print(f"Loaded knowledge base with {_index.manifest['chunks']} chunk(s) from {settings.knowledge_base_path}")
+    return _index
+
+
+def retrieve_context(query: str) -> list:
+    index = get_knowledge_index()
+    if index is None:
+        return []
+    return index.search([query], k=settings.knowledge_top_k, min_score=settings.knowledge_min_score)[0]
+
+
+def build_prompt(contents: str, chunks: list) -> str:
+    """Prefix the conversation with the retrieved reference material."""
+    if not chunks:
+        return contents
+    references = "\n\n".join(f"[{i + 1}] ({os.path.basename(c['source'])})\n{c['text']}" for i, c in enumerate(chunks))
+    return (
+        "Use the following clinic-approved reference material when it is relevant. "
+        "If it does not answer the question, say so rather than guessing.\n\n"
+        f"{references}\n\n---\n\n{contents}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local knowledge base")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="Chunk, embed and index documents (.txt, .md)")
+    ingest.add_argument("paths", nargs="+", help="Files or directories to ingest")
+    ingest.add_argument("--out", default=settings.knowledge_base_path or "knowledge_base", help="Index directory")
+    ingest.add_argument("--model", default=settings.knowledge_embedding_model, help="'hashing' or a sentence-transformers model name")
+    ingest.add_argument("--chunk-words", type=int, default=180)
+    ingest.add_argument("--overlap", type=int, default=40)
+
+    query = commands.add_parser("query", help="Search an index")
+    query.add_argument("text")
+    query.add_argument("--index", default=settings.knowledge_base_path or "knowledge_base")
+    query.add_argument("-k", type=int, default=settings.knowledge_top_k)
+
+    args = parser.parse_args()
+    if args.command == "ingest":
+        manifest = build_index(args.paths, args.out, get_embedder(args.model), args.chunk_words, args.overlap)
+        print(json.dumps(manifest, indent=2))
+    else:
+        for hit in KnowledgeIndex(args.index).search([args.text], k=args.k)[0]:
+            print(f"{hit['score']:.3f}  {hit['source']}#{hit['chunk_index']}  {hit['text'][:100]}")
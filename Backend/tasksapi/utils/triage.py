@@ -0,0 +1,369 @@
+import json
+import re
+import threading
+import time
+from collections import deque
+from string import Template
+from typing import Optional
+from pydantic import BaseModel
+from config import settings
+
+# Pre-LLM triage: match messages against a phrase dictionary and answer
+# emergencies and out-of-scope requests with a fixed template instead of a
+# multi-second generation.
+
+# Condition names on their own ("heart attack", "overdose") score below the
+# threshold, so questions about them still reach the LLM. First-person or
+# acute wording supplies the rest of the score, and informational or negated
+# wording takes some away. Both are modifiers: they only count once a
+# condition phrase of the same rule has matched, so "I'm having a bad day
+# right now" scores nothing.
+ACUTE_PHRASES = [
+    {"phrase": "i'm having", "weight": 0.5, "modifier": True},
+    {"phrase": "i am having", "weight": 0.5, "modifier": True},
+    {"phrase": "having signs of", "weight": 0.5, "modifier": True},
+    {"phrase": "having symptoms of", "weight": 0.5, "modifier": True},
+    {"phrase": "right now", "weight": 0.5, "modifier": True},
+    {"phrase": "happening now", "weight": 0.5, "modifier": True},
+    {"phrase": "call an ambulance", "weight": 0.5, "modifier": True},
+]
+
+INFORMATIONAL_PHRASES = [
+    {"phrase": "signs of", "weight": -0.5, "modifier": True},
+    {"phrase": "sign of", "weight": -0.5, "modifier": True},
+    {"phrase": "symptoms of", "weight": -0.5, "modifier": True},
+    {"phrase": "warning signs", "weight": -0.5, "modifier": True},
+    {"phrase": "risk of", "weight": -0.5, "modifier": True},
+    {"phrase": "how to prevent", "weight": -0.6, "modifier": True},
+    {"phrase": "how do i", "weight": -0.4, "modifier": True},
+    {"phrase": "how to", "weight": -0.4, "modifier": True},
+    {"phrase": "what to do if", "weight": -0.6, "modifier": True},
+    {"phrase": "what is", "weight": -0.3, "modifier": True},
+    {"phrase": "don't have", "weight": -0.6, "modifier": True},
+    {"phrase": "do not have", "weight": -0.6, "modifier": True},
+    {"phrase": "not having", "weight": -0.6, "modifier": True},
+]
+
+DEFAULT_RULES = [
+    {
+        "id": "emergency_cardiac",
+        "category": "emergency",
+        "phrases": [
+            {"phrase": "heart attack", "weight": 0.5},
+            {"phrase": "having a heart attack", "weight": 1.0},
+            {"phrase": "crushing chest", "weight": 1.0},
+            {"phrase": "chest pain", "weight": 0.6},
+            {"phrase": "pain in my chest", "weight": 0.6},
+            {"phrase": "my chest hurts", "weight": 0.6},
+            {"phrase": "chest tightness", "weight": 0.6},
+            {"phrase": "pain in my left arm", "weight": 0.5},
+            {"phrase": "can't breathe", "weight": 0.5},
+            {"phrase": "short of breath", "weight": 0.5},
+            {"phrase": "sweating", "weight": 0.3},
+            *ACUTE_PHRASES,
+            *INFORMATIONAL_PHRASES,
+        ],
+        "response": "emergency",
+    },
+    {
+        "id": "emergency_breathing",
+        "category": "emergency",
+        "phrases": [
+            "can't breathe", "cannot breathe", "can not breathe", "not breathing",
+            "stopped breathing", "struggling to breathe", "turning blue",
+            "i'm choking", "is choking",
+            {"phrase": "choking", "weight": 0.5},
+            *ACUTE_PHRASES,
+            *INFORMATIONAL_PHRASES,
+        ],
+        "response": "emergency",
+    },
+    {
+        "id": "emergency_stroke",
+        "category": "emergency",
+        "phrases": [
+            "having a stroke", "my face is drooping",
+            {"phrase": "face drooping", "weight": 0.6},
+            {"phrase": "face is drooping", "weight": 0.6},
+            {"phrase": "slurred speech", "weight": 0.6},
+            {"phrase": "sudden numbness", "weight": 0.6},
+            {"phrase": "one side of my body", "weight": 0.5},
+            {"phrase": "stroke", "weight": 0.5},
+            *ACUTE_PHRASES,
+            *INFORMATIONAL_PHRASES,
+        ],
+        "response": "emergency",
+    },
+    {
+        "id": "emergency_critical",
+        "category": "emergency",
+        "phrases": [
+            "is unconscious", "is unresponsive", "having a seizure", "won't stop bleeding",
+            "bleeding heavily", "severe bleeding", "overdosed", "took too many pills",
+            "swallowed poison", "throat is closing", "throat closing",
+            {"phrase": "unconscious", "weight": 0.5},
+            {"phrase": "unresponsive", "weight": 0.5},
+            {"phrase": "not responding", "weight": 0.5},
+            {"phrase": "overdose", "weight": 0.5},
+            {"phrase": "anaphylaxis", "weight": 0.5},
+            *ACUTE_PHRASES,
+            *INFORMATIONAL_PHRASES,
+        ],
+        "response": "emergency",
+    },
+    {
+        "id": "crisis_self_harm",
+        "category": "crisis",
+        "phrases": [
+            "kill myself", "killing myself", "suicide", "suicidal", "end my life",
+            "want to die", "hurt myself", "harm myself", "self harm",
+        ],
+        "response": "crisis",
+    },
+    {
+        "id": "out_of_scope",
+        "category": "out_of_scope",
+        "phrases": [
+            "write me a poem", "write a poem", "write a song", "tell me a joke",
+            "stock price", "stock tips", "crypto", "bitcoin", "sports score",
+            "do my homework", "write code", "python script", "movie recommendation",
+        ],
+        "response": "out_of_scope",
+    },
+]
+
+DEFAULT_TEMPLATES = {
+    "emergency": (
+        "⚠️ **This may be a medical emergency.** Please call **$emergency_number** "
+        "or go to the nearest emergency department right now. Do not wait for an "
+        "online answer. If someone is with you, ask them to stay with you until help arrives."
+    ),
+    "crisis": (
+        "I'm really sorry you're feeling this way. You don't have to go through it alone. "
+        "Please contact **$crisis_line** now, or call **$emergency_number** if you are in "
+        "immediate danger. Talking to someone you trust can also help."
+    ),
+    "out_of_scope": (
+        "I'm a healthcare assistant, so I can only help with health and medical questions. "
+        "Is there something about your health I can help you with?"
+    ),
+}
+
+
+def normalize(text: str) -> str:
+    """Lowercase, unify apostrophes and reduce everything else to single spaces.
+
+    The result is padded with spaces so that matching `` phrase `` against it
+    only finds whole words.
+    """
+    text = text.lower().replace("’", "'").replace("‘", "'")
+    text = re.sub(r"[^\w']+", " ", text)
+    return f" {' '.join(text.split())} "
+
+
+class AhoCorasick:
+    """Aho–Corasick automaton finding every dictionary phrase in one pass."""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for value, pattern in patterns:
+            self._add(pattern, value)
+        self._build()
+
+    def _add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        self._output[state].append(value)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def find(self, text):
+        """Yield the value of every pattern occurring in ``text``."""
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                yield from output[state]
+
+
+class TriageMatch(BaseModel):
+    rule_id: str
+    category: str
+    score: float
+    phrases: list
+    response: str
+    latency_ms: float
+
+
+class TriageClassifier:
+    """Score messages against weighted phrase rules.
+
+    Each phrase adds its weight (1.0 by default) to its rule, counting a phrase
+    once per message. Negative weights lower the score. Phrases marked
+    ``"modifier": true`` only count when a non-modifier phrase of the same rule
+    matched too. The first rule, in dictionary order, whose score reaches its
+    ``threshold`` (1.0 by default) fires.
+    """
+
+    def __init__(self, rules, templates, variables):
+        self.rules = rules
+        self.templates = templates
+        self.variables = variables
+        patterns = []
+        for rule_index, rule in enumerate(rules):
+            for phrase in rule["phrases"]:
+                if isinstance(phrase, str):
+                    phrase = {"phrase": phrase, "weight": 1.0}
+                value = (rule_index, phrase["phrase"], phrase.get("weight", 1.0), phrase.get("modifier", False))
+                patterns.append((value, normalize(phrase["phrase"])))
+        self.automaton = AhoCorasick(patterns)
+
+    @classmethod
+    def from_settings(cls):
+        rules, templates = DEFAULT_RULES, dict(DEFAULT_TEMPLATES)
+        if settings.triage_rules_path:
+            with open(settings.triage_rules_path, encoding="utf-8") as f:
+                config = json.load(f)
+            rules = config.get("rules", rules)
+            templates.update(config.get("templates", {}))
+        variables = {
+            "emergency_number": settings.emergency_number,
+            "crisis_line": settings.crisis_line,
+        }
+        return cls(rules, templates, variables)
+
+    def classify(self, message: str) -> Optional[TriageMatch]:
+        started = time.perf_counter()
+        scores = {}
+        matched = {}
+        conditions = set()
+        for rule_index, phrase, weight, modifier in set(self.automaton.find(normalize(message))):
+            scores[rule_index] = scores.get(rule_index, 0.0) + weight
+            matched.setdefault(rule_index, []).append(phrase)
+            if not modifier:
+                conditions.add(rule_index)
+
+        for rule_index in sorted(conditions):
+            rule = self.rules[rule_index]
+            if scores[rule_index] >= rule.get("threshold", 1.0):
+                template = self.templates.get(rule["response"], rule["response"])
+                return TriageMatch(
+                    rule_id=rule["id"],
+                    category=rule["category"],
+                    score=round(scores[rule_index], 3),
+                    phrases=sorted(matched[rule_index]),
+                    response=Template(template).safe_substitute(self.variables),
+                    latency_ms=(time.perf_counter() - started) * 1000,
+                )
+        return None
+
+
+# Expected rule (or None for "goes to the LLM") for the default rules. Run
+# ``python -m tasksapi.utils.triage`` after changing phrases or weights.
+CHECK_CASES = [
+    # Everyday or informational messages must reach the LLM
+    ("I'm having a headache right now", None),
+    ("I am having trouble sleeping right now", None),
+    ("I'm having a bad day right now", None),
+    ("What is happening now with my test results?", None),
+    ("What are the warning signs of a heart attack?", None),
+    ("what is the overdose limit for acetaminophen", None),
+    ("how do I use an EpiPen for anaphylaxis", None),
+    ("what is a stroke", None),
+    ("is face drooping a sign of stroke", None),
+    ("how to prevent choking in toddlers", None),
+    ("what to do if someone is choking", None),
+    ("how do I lower my risk of stroke", None),
+    ("I don't have chest pain but my arm is sore", None),
+    ("what should I eat to lower my blood pressure", None),
+    # Acute messages must get the template
+    ("I think I'm having a heart attack", "emergency_cardiac"),
+    ("my chest hurts and I can't breathe", "emergency_cardiac"),
+    ("crushing chest pain and sweating", "emergency_cardiac"),
+    ("I'm having signs of a heart attack", "emergency_cardiac"),
+    ("I'm having chest pain right now", "emergency_cardiac"),
+    ("my baby is choking", "emergency_breathing"),
+    ("she stopped breathing", "emergency_breathing"),
+    ("i think i'm having a stroke, my face is drooping", "emergency_stroke"),
+    ("my husband has slurred speech and face drooping", "emergency_stroke"),
+    ("my dad is unconscious", "emergency_critical"),
+    ("I overdosed on my pills", "emergency_critical"),
+    ("I took too many pills", "emergency_critical"),
+    ("I'm having anaphylaxis", "emergency_critical"),
+    ("I want to kill myself", "crisis_self_harm"),
+    ("tell me a joke", "out_of_scope"),
+]
+
+
+def check_cases(classifier, cases=CHECK_CASES) -> list:
+    """Return ``(message, expected, actual)`` for every case the classifier gets wrong."""
+    failures = []
+    for message, expected in cases:
+        match = classifier.classify(message)
+        actual = match.rule_id if match else None
+        if actual != expected:
+            failures.append((message, expected, actual))
+    return failures
+
+
+class LatencyTracker:
+    """Exponentially weighted average of LLM generation time."""
+
+    def __init__(self, alpha=0.2, initial_ms=3000.0):
+        self.alpha = alpha
+        self.average_ms = initial_ms
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms: float):
+        with self._lock:
+            self.average_ms += self.alpha * (elapsed_ms - self.average_ms)
+
+
+classifier = TriageClassifier.from_settings()
+llm_latency = LatencyTracker()
+
+
+def triage_message(message: str) -> Optional[TriageMatch]:
+    """Return the fired rule for ``message``, or None if it should go to the LLM."""
+    if not settings.triage_enabled:
+        return None
+    match = classifier.classify(message)
+    if match:
+        saved_ms = llm_latency.average_ms - match.latency_ms
+        print(
+            f"[TRIAGE] rule={match.rule_id} category={match.category} score={match.score} "
+            f"phrases={match.phrases} latency={match.latency_ms * 1000:.0f}us saved~{saved_ms:.0f}ms"
+        )
+    return match
+
+
+if __name__ == "__main__":
+    import sys
+    failures = check_cases(TriageClassifier(DEFAULT_RULES, DEFAULT_TEMPLATES, {}))
+    for message, expected, actual in failures:
+        print(f"FAIL {message!r}: expected {expected}, got {actual}")
+    print(f"{len(CHECK_CASES) - len(failures)}/{len(CHECK_CASES)} triage cases passed")
+    sys.exit(1 if failures else 0)